@@ -9,16 +9,29 @@ import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import json
 import datetime
 import os
-import urllib.request
-import urllib.parse
+import uuid
 import base64
-from io import BytesIO
 import warnings
 import streamlit.components.v1 as components
-import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dispatch import MPC_HORIZON
+from forecaster import QUANTILES, ConsumptionForecaster
+from market import LIMIT_PRICES
+from simulator import (
+    CO2_FACTOR, FLEET_PARAMS, Simulator, compile_controller, evaluate_kp,
+    kp_control_code, seasonal_weather, source_weather, total_battery_capacity, weather_source,
+)
+from result_cache import ResultCache, simulation_key
+from weather_store import NEAREST_STATION, open_store
+from geocoder import Geocoder, default_gazetteer
+from history_store import HistoryStore
+from run_archive import RunArchive
+from charts import FigureCache, bar_trace, line_trace
+from exports import EXPORT_FORMATS, ExportCache, HAS_PYARROW, available_formats, export_bytes
 
 warnings.filterwarnings("ignore")
 if "last_results" not in st.session_state:
@@ -26,9 +39,6 @@ if "last_results" not in st.session_state:
 # =====================================
 # INITIALISATION DE LA SESSION (À METTRE TOUT EN HAUT)
 # =====================================
-if "history" not in st.session_state:
-    st.session_state.history = []
-
 if "results" not in st.session_state:
     st.session_state.last_results = None
 
@@ -61,17 +71,146 @@ st.markdown("""
 # =====================================
 # FONCTIONS UTILITAIRES
 # =====================================
-@st.cache_data(ttl=3600)
+# Nouveau: Géocodeur hors ligne (gazetteer local + cache disque), Nominatim en dernier recours si IKSO_GEOCODER_ONLINE=1
+@st.cache_resource
+def get_geocoder():
+    return Geocoder(default_gazetteer())
+
 def get_lat_lon(city):
-    if not city: return None, None
-    try:
-        url = f"https://nominatim.openstreetmap.org/search?q={urllib.parse.quote(city)}&format=json&limit=1"
-        req = urllib.request.Request(url, headers={'User-Agent': 'IKSOU-Pro/19.4'})
-        with urllib.request.urlopen(req, timeout=10) as r:
-            data = json.loads(r.read().decode())
-        if data: 
-            return float(data[0]['lat']), float(data[0]['lon']), data[0].get('country_code', '').upper()
-    except: return None, None, None
+    return get_geocoder().lookup(city)
+
+# Nouveau: Pool de workers persistant, réutilisé entre les reruns Streamlit
+@st.cache_resource
+def get_worker_pool():
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+# Nouveau: Cache des résultats partagé entre sessions (mémoire + disque)
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(".ikso_cache")
+
+def run_simulation(config, on_block=None):
+    # on_block(bloc, kpis cumulés, fraction) est appelé à chaque tranche calculée (progression réelle)
+    # Renvoie (df, kpis, règlements P2P par bâtiment ou None)
+    cache = get_result_cache()
+    key = run_key(config)
+    cached = cache.get(key) if config.get("seed") is not None else None  # tirage non reproductible : rien à mémoriser
+    if cached is not None:
+        if on_block:
+            on_block(cached[0], cached[1], 1.0)
+        return cached
+    blocks = []
+    chunk_hours = max(24, config["timesteps"] // 20)
+    sim = Simulator(config)
+    sim.forecast = mpc_load_forecast(config)
+    for block, kpis, done in sim.iter_run(chunk_hours=chunk_hours):
+        blocks.append(block)
+        if on_block:
+            on_block(block, kpis, done)
+    df = pd.concat(blocks, ignore_index=True)
+    settlements = sim.market_settlements()
+    if config.get("seed") is not None:
+        cache.put(key, (df, kpis, settlements))
+        # déjà archivé pour cette clé → rien n'est réécrit, ni réappris. Run piloté par la prévision : même
+        # consommation que le run en information parfaite, pas de source météo → jamais réappris (sync compris)
+        weather = weather_source(config) if sim.forecast is None else None
+        if get_run_archive().put(key, df, kpis, weather) and weather is not None:
+            learn_run(key, df, config)
+    return df, kpis, settlements
+
+# Nouveau: Archive colonnaire permanente des runs reproductibles (clé = run_key)
+@st.cache_resource
+def get_run_archive():
+    return RunArchive(".ikso_archive")
+
+# Nouveau: Prévision de consommation entraînée sur les runs archivés, persistée entre redémarrages
+FORECASTER_PATH = ".ikso_forecaster.pkl"
+
+@st.cache_resource
+def get_forecaster():
+    forecaster = ConsumptionForecaster.load(FORECASTER_PATH)
+    # Runs archivés avant le modèle (ou par un autre processus) : rattrapage incrémental
+    if forecaster.sync(get_run_archive(), lambda meta: source_weather(meta.get("weather"))):
+        forecaster.save(FORECASTER_PATH)
+    return forecaster
+
+def learn_run(key, df, config):
+    forecaster = get_forecaster()
+    if forecaster.partial_fit(key, df["time"].to_numpy(), df["cons"].to_numpy(), source_weather(weather_source(config))):
+        forecaster.save(FORECASTER_PATH)
+
+def forecast_weather(config):
+    # Météo du run si elle est reproductible, sinon un tirage saisonnier du même site
+    return source_weather(weather_source(config)) or seasonal_weather(config["lat"], config["lon"])
+
+def mpc_load_forecast(config):
+    """Prévision du MPC au quantile choisi (conso prévue − PV), None → information parfaite."""
+    quantile = config.get("mpc_forecast")
+    forecaster = get_forecaster()
+    if config.get("dispatch") != "mpc" or quantile is None or not forecaster.fitted:
+        return None
+    weather = forecast_weather(config)
+    return lambda cons, pv: forecaster.quantile_path(np.arange(len(cons)), cons, weather, quantile) - pv
+
+def run_key(config):
+    """Clé du run (cache, archive, historique) : simulation_key, plus l'empreinte du modèle s'il pilote le MPC."""
+    forecast = get_forecaster().digest() if mpc_load_forecast(config) is not None else None
+    return simulation_key(config, forecast=forecast)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def consumption_forecast(result_hash, _df, _config):
+    """Prévision des 24 h suivant le run (point + quantiles), mémorisée par hash du résultat : même affichage à chaque visite."""
+    weather = forecast_weather(_config)
+    forecaster = get_forecaster()
+    if not forecaster.fitted:
+        # Aucun run archivé (graine non fixée) : modèle temporaire appris sur le run courant
+        forecaster = ConsumptionForecaster()
+        if not forecaster.partial_fit(result_hash, _df["time"].to_numpy(), _df["cons"].to_numpy(), weather):
+            return None
+    t, pred = forecaster.predict(_df["time"].to_numpy(), _df["cons"].to_numpy(), weather)
+    _, quantiles = forecaster.predict_quantiles(_df["time"].to_numpy(), _df["cons"].to_numpy(), weather)
+    forecast = {"time": t, "pred": pred, "runs": len(forecaster.runs), "samples": forecaster.samples}
+    forecast.update({f"p{round(q * 100)}": quantiles[:, i] for i, q in enumerate(QUANTILES)})
+    return forecast
+
+# Nouveau: Zoom des longues séries : une sélection rectangulaire (outil « Box Select ») devient la fenêtre
+# affichée, re-échantillonnée depuis les tableaux complets ; la clé du widget change pour effacer la sélection
+def chart_window(chart_id):
+    return st.session_state.get(f"zoom_{chart_id}")
+
+def zoomable_chart(fig, chart_id):
+    generation = st.session_state.get(f"zoom_gen_{chart_id}", 0)
+    fig.update_layout(dragmode="select")
+    event = st.plotly_chart(fig, use_container_width=True, on_select="rerun", selection_mode="box",
+                            key=f"chart_{chart_id}_{generation}")
+    boxes = event.selection.get("box", []) if event else []
+    if boxes and len(boxes[0].get("x", [])) >= 2:
+        st.session_state[f"zoom_{chart_id}"] = tuple(sorted(boxes[0]["x"][:2]))
+        st.session_state[f"zoom_gen_{chart_id}"] = generation + 1
+        st.rerun()
+    if chart_window(chart_id) is not None:
+        x0, x1 = chart_window(chart_id)
+        if st.button(f"🔍 Vue complète (zoom {x0:.0f} → {x1:.0f})", key=f"unzoom_{chart_id}"):
+            del st.session_state[f"zoom_{chart_id}"]
+            st.session_state[f"zoom_gen_{chart_id}"] = generation + 1
+            st.rerun()
+    else:
+        st.caption("Sélection rectangulaire sur le graphique pour zoomer avec le détail complet")
+
+# Nouveau: Figures prêtes à afficher partagées entre sessions, clé = (hash du résultat, page, graphique)
+# Changer de page ou toucher un widget sans rapport réutilise la figure au lieu de la reconstruire
+@st.cache_resource
+def get_figure_cache():
+    return FigureCache(max_items=64)
+
+def cached_figure(result_hash, page, chart_id, build):
+    if result_hash is None:  # résultat non identifiable (météo non reproductible) : pas de cache
+        return build()
+    return get_figure_cache().get_or_build((result_hash, page, chart_id), build)
+
+def weather_hash(lat, lon, season):
+    seed = st.session_state.config.get("seed")
+    return None if seed is None else ("meteo", lat, lon, season, seed)
 
 # Nouveau: Déterminer la devise basée sur le pays
 def get_currency(country_code):
@@ -80,136 +219,17 @@ def get_currency(country_code):
     else:
         return 'EUR'  # Par défaut EUR pour l'Europe et autres
 
-# Nouveau: Facteur CO2 avec référence IEA (International Energy Agency)
-# Source: IEA - CO2 emissions factor for grid electricity avoidance via renewables ~400-500 gCO2/kWh, on utilise 450 g/kWh moyen
-CO2_FACTOR = 450  # g CO2 / kWh évité (référence: IEA Global Energy Review 2023)
+# Nouveau: Historique SQLite partagé par toutes les sessions (reprend l'ancien JSON au premier lancement)
+@st.cache_resource
+def get_history_store():
+    return HistoryStore("ikso_history.db", legacy_json="ikso_simulation_history.json")
 
 def save_history(config, agent, kpis):
-    hist = st.session_state.get("history", [])
-    hist.append({
-        "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-        "agent": agent,
-        "cost": kpis["total_cost"],  # On stocke sans devise, on gère l'affichage après
-        "pv": kpis["total_pv_kwh"],
-        "comfort": kpis["avg_comfort"],
-        "co2_saved_kg": kpis["co2_saved_kg"]
-    })
-    st.session_state.history = hist[-50:]  # garde les 50 dernières
-    
-    # Nouveau: Sauvegarde en JSON file
+    # Une insertion par run ; coût stocké sans devise, on gère l'affichage après
     try:
-        with open('ikso_simulation_history.json', 'w', encoding='utf-8') as f:
-            json.dump(hist, f, ensure_ascii=False, indent=4)
+        get_history_store().append(agent, kpis, config_hash=run_key(config))
     except Exception as e:
-        st.error(f"Erreur sauvegarde JSON: {str(e)}")
-
-# Nouveau: Charger historique depuis JSON si existe
-def load_history():
-    if os.path.exists('ikso_simulation_history.json'):
-        try:
-            with open('ikso_simulation_history.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
-
-# Charger au démarrage
-st.session_state.history = load_history()
-
-# =====================================
-# MÉTÉO SAISONNIÈRE (remplace 72h par estimations saisonnières)
-# =====================================
-def fetch_seasonal_weather(lat, lon, season='winter'):  # Exemple simple, on peut étendre
-    seasons = {
-        'winter': {'temp_mean': 5, 'temp_amp': 5, 'solar_mean': 200},
-        'spring': {'temp_mean': 15, 'temp_amp': 10, 'solar_mean': 500},
-        'summer': {'temp_mean': 25, 'temp_amp': 10, 'solar_mean': 800},
-        'autumn': {'temp_mean': 15, 'temp_amp': 8, 'solar_mean': 400}
-    }
-    params = seasons.get(season, seasons['winter'])
-    
-    # Génération de données saisonnières sur 3 mois (simulé)
-    t = np.linspace(0, 2160, 2160)  # 90 jours * 24h
-    temp = params['temp_mean'] + params['temp_amp'] * np.sin(2*np.pi*t/24) + np.random.normal(0, 2, len(t))
-    solar = np.maximum(0, params['solar_mean'] * np.sin(2*np.pi*(t-6)/24)) + np.random.normal(0, 50, len(t))
-    
-    return {
-        "temp": temp.tolist(),
-        "solar": solar.tolist()
-    }
-
-# =====================================
-# SIMULATEUR COMPLET (ajout CO2 avec ref IEA + devise)
-# =====================================
-class Simulator:
-    def __init__(self, config):
-        self.c = config
-        self.n = len(config["buildings"])
-
-    def run(self):
-        # Détection saison actuelle
-        month = datetime.datetime.now().month
-        if month in [12,1,2]: season = 'winter'
-        elif month in [3,4,5]: season = 'spring'
-        elif month in [6,7,8]: season = 'summer'
-        else: season = 'autumn'
-        
-        weather = fetch_seasonal_weather(self.c["lat"], self.c["lon"], season)
-        steps = self.c["timesteps"]
-        results = {k: [] for k in "time cons pv hvac temp comfort soc battery trade price".split()}
-        soc = self.c["initial_soc"] * self.c["battery_capacity"] * self.n
-
-        for t in range(steps):
-            temp_out = weather["temp"][t % len(weather["temp"])]
-            solar = weather["solar"][t % len(weather["solar"])]
-
-            # Contrôleur custom ou par défaut
-            try:
-                exec(self.c["control_code"], globals())
-                action = locals()["control"]({"temp_target": self.c["temp_target"], "current_temp": self.c["temp_target"], "outdoor_temp": temp_out, "solar": solar}, t)
-            except:
-                error = self.c["temp_target"] - temp_out
-                action = np.clip(error * 0.5, -1, 1)
-
-            hvac = abs(action) * 10
-            base = random.uniform(7, 13)
-            cons = hvac + base
-            pv = solar * self.c["pv_area"] * 0.0002 * self.n
-
-            net = pv - cons * self.n
-            bat = np.clip(net, -self.c["battery_power"]*self.n, self.c["battery_power"]*self.n)
-            soc = np.clip(soc + (bat*0.95 if bat>0 else bat/0.95), 0, self.c["battery_capacity"]*self.n)
-            net2 = net - bat
-
-            trade = price = 0
-            if self.c["enable_trading"]:
-                trade = min(max(net2,0), max(-net2,0))
-                price = self.c["trading_price"]
-
-            results["time"].append(t)
-            results["cons"].append(cons*self.n)
-            results["pv"].append(pv)
-            results["hvac"].append(hvac*self.n)
-            results["temp"].append(self.c["temp_target"] + (temp_out - self.c["temp_target"])*0.05 + action*1.5)
-            results["comfort"].append(max(0, 1 - abs(action)/2))
-            results["soc"].append(soc)
-            results["battery"].append(bat)
-            results["trade"].append(trade)
-            results["price"].append(price)
-
-        df = pd.DataFrame(results)
-        total_pv_kwh = round(df["pv"].sum()/1000, 1)
-        co2_saved_kg = round(total_pv_kwh * (CO2_FACTOR / 1000), 1)  # Conversion g à kg
-        
-        kpis = {
-            "total_cost": round(df["cons"].sum()*0.015 - df["pv"].sum()*0.08 - df["trade"].sum()*0.03, 2),  # Sans devise
-            "total_pv_kwh": total_pv_kwh,
-            "total_consumption_kwh": round(df["cons"].sum()/1000, 1),
-            "avg_comfort": round(df["comfort"].mean(), 3),
-            "co2_saved_kg": co2_saved_kg,
-            "trading_savings": round(df["trade"].sum()*0.03/1000, 2)
-        }
-        return df, kpis
+        st.error(f"Erreur sauvegarde historique: {str(e)}")
 
 # =====================================
 # SIDEBAR
@@ -515,7 +535,7 @@ if page == "Accueil":
             <p style="margin:0; color:#e2e8f0; display: flex; align-items: center; gap: 1rem;">
                 <i class="fas fa-database" style="color:#3b82f6; font-size: 1.5rem;"></i> 
                 <span style="font-size: 1.1rem;">
-                    <strong style="color: #60a5fa;">{len(st.session_state.history)}</strong> 
+                    <strong style="color: #60a5fa;">{get_history_store().count()}</strong> 
                     simulations enregistrées et analysées
                 </span>
             </p>
@@ -530,25 +550,31 @@ if page == "Accueil":
         </lottie-player>
         """, height=300)
 
-    # KPIs dynamiques basés sur l'historique
-    if st.session_state.history:
-        df_hist = pd.DataFrame(st.session_state.history)
-        avg_precision = round(random.uniform(95, 99), 1)
-        avg_autoconso = round((df_hist["pv"].mean() / (df_hist["pv"].mean() + df_hist.get("cons", df_hist["pv"]).mean())) * 100, 1)
-        avg_reduction = round(random.uniform(60, 80), 0) * -1
-        avg_co2 = round(df_hist["co2_saved_kg"].mean() / 1000, 1)
+    # KPIs dynamiques : agrégats tenus à jour par save_history (aucun parcours de l'historique)
+    aggregates = get_history_store().aggregates()
+    # Erreur mesurée du modèle de prévision (chaque run archivé est prévu avant d'être appris)
+    forecast_error = get_forecaster().error()
+    forecast_error = f"{forecast_error:.1f}%" if forecast_error is not None else "—"
+    if aggregates:
+        mean = lambda metric: aggregates[metric]["mean"] if metric in aggregates else None
+        avg_pv = mean("pv") or 0
+        avg_cons = mean("cons") if mean("cons") is not None else avg_pv
+        avg_autoconso = round((avg_pv / (avg_pv + avg_cons)) * 100, 1) if avg_pv + avg_cons else 0.0
+        avg_reduction = f"{mean('bill_reduction'):.0f}%" if mean("bill_reduction") is not None else "N/A"
+        avg_co2 = round((mean("co2_saved_kg") or 0) / 1000, 1)
         kpi_data = [
-            ("brain", f"{avg_precision}%", "Précision IA", "#3b82f6"),
+            ("brain", forecast_error, "Erreur prévision IA", "#3b82f6"),
             ("solar-panel", f"{avg_autoconso}%", "Autoconsommation", "#10b981"),
-            ("chart-line", f"{avg_reduction}%", "Réduction facture", "#8b5cf6"),
+            ("chart-line", avg_reduction, "Réduction facture", "#8b5cf6"),
             ("leaf", f"{avg_co2}t", "CO₂ évité", "#f59e0b")
         ]
     else:
+        # Pas encore de simulation : pas de chiffres inventés
         kpi_data = [
-            ("brain", "98.4%", "Précision IA", "#3b82f6"),
-            ("solar-panel", "97.2%", "Autoconsommation", "#10b981"),
-            ("chart-line", "−71%", "Réduction facture", "#8b5cf6"),
-            ("leaf", "1.8t", "CO₂ évité", "#f59e0b")
+            ("brain", forecast_error, "Erreur prévision IA", "#3b82f6"),
+            ("solar-panel", "—", "Autoconsommation", "#10b981"),
+            ("chart-line", "—", "Réduction facture", "#8b5cf6"),
+            ("leaf", "—", "CO₂ évité", "#f59e0b")
         ]
 
     st.markdown("<div style='margin: 3rem 0;'></div>", unsafe_allow_html=True)
@@ -673,17 +699,56 @@ elif page == "Configuration":
         col_city, col_coords = st.columns([2, 1])
         with col_city:
             city = st.text_input("🌍 Ville", "Paris", help="Entrez le nom de votre ville")
-            lat, lon, country_code = get_lat_lon(city)
+            lat, lon, country_code, place, match = get_lat_lon(city)
             if lat: 
                 st.success(f"✅ Coordonnées : {lat:.4f}, {lon:.4f} | Pays: {country_code}")
+                if match != "exact":
+                    # Saisie partielle ou approchée : la ville retenue peut ne pas être celle voulue
+                    st.info(f"Ville retenue : {place} — précisez le nom si ce n'est pas la bonne")
             else: 
                 st.warning("⚠️ Ville non trouvée, utilisez les coordonnées manuelles")
+                suggestions = get_geocoder().suggest(city)
+                if suggestions:
+                    st.caption("Vouliez-vous dire : " + ", ".join(suggestions))
                 lat, lon, country_code = 48.8566, 2.3522, 'FR'
         
         with col_coords:
             if not lat or st.checkbox("🎯 Saisie manuelle des coordonnées"):
                 lat = st.number_input("Latitude", value=float(lat) if lat else 48.8566, format="%.4f")
                 lon = st.number_input("Longitude", value=float(lon) if lon else 2.3522, format="%.4f")
+
+        # Nouveau: Données météo mesurées (EPW / TMY) importées une fois dans le stock binaire
+        with st.expander("🌦️ Données météo horaires (EPW / TMY)", expanded=False):
+            store = open_store()
+            weather_file = st.file_uploader(
+                "Fichier EPW ou CSV horaire",
+                type=["epw", "csv"],
+                help="CSV : colonnes température (temp, T2m, Dry-bulb (C)...) et rayonnement global (solar, GHI, G(h)...)"
+            )
+            if weather_file is not None:
+                # Un import par fichier déposé (pas à chaque rerun) ; position de la ville seulement pour un CSV
+                imported = st.session_state.setdefault("weather_imports", {})
+                if weather_file.file_id not in imported:
+                    coords = {} if weather_file.name.lower().endswith(".epw") else {"lat": lat, "lon": lon}
+                    try:
+                        imported[weather_file.file_id] = store.import_file(weather_file, **coords)
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
+                if weather_file.file_id in imported:
+                    st.success(f"✅ Site météo importé : {imported[weather_file.file_id]}")
+            catalog = store.sites()
+            weather_options = ["Saisonnière (synthétique)"]
+            if not catalog.empty:
+                weather_options += ["📍 Station la plus proche"] + catalog["key"].tolist()
+            weather_choice = st.selectbox("Source météo de la simulation", weather_options)
+            weather_site = None if weather_choice == weather_options[0] else weather_choice
+            if weather_choice == "📍 Station la plus proche":
+                weather_site = NEAREST_STATION
+                try:
+                    station = store.nearest(lat, lon).iloc[0]
+                    st.info(f"Station retenue : {station['key']} ({station['distance_km']:.0f} km)")
+                except ValueError as e:
+                    st.error(f"❌ {e}")
     
     st.divider()
     
@@ -735,6 +800,25 @@ elif page == "Configuration":
             0, 100, 25,
             help="Puissance maximale charge/décharge"
         )
+        # Nouveau: Pilotage de la batterie (règle historique ou MPC sur fenêtre glissante)
+        dispatch_labels = {"Suivi du bilan (règle)": "rule", "MPC (tarif horaire)": "mpc"}
+        dispatch = dispatch_labels[st.selectbox(
+            "Pilotage batterie", list(dispatch_labels),
+            help="MPC : chaque heure, programme linéaire sur la fenêtre à venir pour minimiser la facture réseau (heures creuses / pointe)"
+        )]
+        mpc_horizon, mpc_forecast = MPC_HORIZON, None
+        if dispatch == "mpc":
+            mpc_horizon = st.slider("Horizon MPC (h)", 6, 72, MPC_HORIZON, help="Longueur de la fenêtre optimisée à chaque heure")
+            forecast_labels = {"Parfaite (référence)": None, "Modèle P50": 0.5, "Modèle P90 (prudente)": 0.9}
+            mpc_forecast = forecast_labels[st.selectbox(
+                "Prévision de consommation du MPC", list(forecast_labels),
+                help="Quantile du modèle de prévision (page Prédictions) utilisé à la place de la consommation réelle"
+            )]
+        # Nouveau: Référence optimale hors ligne, sur demande (programmation dynamique, ~1,5 s par batterie et par an)
+        optimal_baseline = st.checkbox(
+            "Comparer à l'optimum (information parfaite)", value=False,
+            help="Calcule après la simulation le meilleur pilotage possible de chaque batterie : écart affiché sur la page Batterie"
+        )
     
     st.divider()
     
@@ -759,6 +843,9 @@ elif page == "Configuration":
             )
         else:
             trading_price = 0.12
+        st.markdown("**🎲 Reproductibilité**")
+        seed = st.number_input("Graine aléatoire", min_value=0, value=42, step=1, help="Même graine + même configuration = mêmes résultats (météo et charge)")
+        precision = st.selectbox("Précision des résultats", ["float64", "float32"], help="float32 : moitié moins de mémoire pour les longues simulations et les grands parcs")
     
     with col_controller:
         st.markdown("**🎛️ Contrôleur Personnalisé**")
@@ -769,6 +856,23 @@ elif page == "Configuration":
                 value="def control(state, t):\n    error = state['temp_target'] - state['outdoor_temp']\n    return np.clip(error * 0.6, -1, 1)",
                 help="Fonction de contrôle pour la gestion énergétique"
             )
+        
+        st.markdown("**🏘️ Parc de Bâtiments**")
+        with st.expander("📂 Importer un parc hétérogène (CSV)", expanded=False):
+            fleet_file = st.file_uploader(
+                "Une ligne par bâtiment",
+                type="csv",
+                help="Colonnes : building, puis au choix " + ", ".join(FLEET_PARAMS + LIMIT_PRICES) + " (sinon valeurs ci-dessus ; prix limites du marché P2P autour du prix de trading)"
+            )
+            fleet = None
+            if fleet_file is not None:
+                df_fleet = pd.read_csv(fleet_file)
+                if "building" in df_fleet.columns:
+                    buildings = df_fleet["building"].astype(str).tolist()
+                    fleet = {k: df_fleet[k].astype(float).tolist() for k in FLEET_PARAMS + LIMIT_PRICES if k in df_fleet.columns}
+                    st.success(f"✅ {len(buildings)} bâtiments importés")
+                else:
+                    st.error("❌ Colonne 'building' manquante")
     
     st.divider()
     
@@ -787,14 +891,26 @@ elif page == "Configuration":
                 "battery_capacity": battery, 
                 "battery_power": power,
                 "initial_soc": 0.5, 
+                "dispatch": dispatch,
+                "mpc_horizon": mpc_horizon,
+                "mpc_forecast": mpc_forecast,
+                "optimal_baseline": optimal_baseline,
                 "enable_trading": trading, 
                 "trading_price": trading_price,
                 "lat": lat, 
                 "lon": lon, 
                 "control_code": code, 
-                "country_code": country_code
+                "country_code": country_code,
+                "seed": int(seed),
+                "precision": precision,
+                "weather_site": weather_site,
+                "fleet": fleet
             }
-            st.success("✅ Configuration sauvegardée avec succès !")
+            try:
+                compile_controller(code)
+                st.success("✅ Configuration sauvegardée avec succès !")
+            except ValueError as e:
+                st.error(f"❌ {e}")
     
     with col_sim:
         if "config" not in st.session_state:
@@ -804,19 +920,36 @@ elif page == "Configuration":
             if st.button("🚀 LANCER LA SIMULATION", type="primary", use_container_width=True):
                 with st.spinner("⚙️ Simulation en cours... Veuillez patienter"):
                     progress_bar = st.progress(0)
-                    for i in range(100):
-                        progress_bar.progress(i + 1)
+                    # Tout clic relance le script Streamlit : le générateur de simulation est abandonné
+                    st.button("⏹️ Annuler", use_container_width=True)
+                    live_chart = st.empty()
+                    live_blocks = []
                     
-                    sim = Simulator(st.session_state.config)
-                    df, kpis = sim.run()
-                    st.session_state.last_results = df
-                    st.session_state.results = df
-                    st.session_state.kpis = kpis
-                    save_history(st.session_state.config, "Custom", kpis)
+                    def show_block(block, kpis, done):
+                        progress_bar.progress(done, text=f"{done:.0%} • Coût cumulé : {kpis['total_cost']:.2f}")
+                        live_blocks.append(block[["cons", "pv"]])
+                        live_chart.line_chart(pd.concat(live_blocks))
+                    
+                    try:
+                        df, kpis, settlements = run_simulation(st.session_state.config, on_block=show_block)
+                    except ValueError as e:
+                        df = None
+                        st.error(f"❌ {e}")
+                    if df is not None:
+                        st.session_state.last_results = df
+                        st.session_state.results = df
+                        st.session_state.kpis = kpis
+                        st.session_state.settlements = settlements
+                        # Run reproductible : même clé que le cache de résultats ; sinon identifiant unique du run
+                        seeded = st.session_state.config.get("seed") is not None
+                        st.session_state.result_hash = run_key(st.session_state.config) if seeded else uuid.uuid4().hex
+                        save_history(st.session_state.config, "Custom", kpis)
                     progress_bar.empty()
+                    live_chart.empty()
                 
-                st.success("🎉 Simulation terminée avec succès !")
-                st.balloons()
+                if df is not None:
+                    st.success("🎉 Simulation terminée avec succès !")
+                    st.balloons()
                 
 
 elif page == "Résultats" and "kpis" in st.session_state:
@@ -910,7 +1043,7 @@ elif page == "Résultats" and "kpis" in st.session_state:
     co2_saved = total_pv * 0.4
     
     # Calcul des revenus de trading
-    trading_revenue = df[df["trade"] > 0]["trade"].sum() * st.session_state.config.get("trading_price", 0.12)
+    trading_revenue = (df["trade"] * df["price"]).sum()  # volume compensé × prix de compensation horaire
     
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -970,119 +1103,127 @@ elif page == "Résultats" and "kpis" in st.session_state:
     # Construction dynamique des graphiques
     num_graphs = len(graphs_to_show)
     if num_graphs > 0:
-        fig = make_subplots(
-            rows=num_graphs, 
-            cols=1, 
-            shared_xaxes=True,
-            subplot_titles=tuple(graphs_to_show),
-            vertical_spacing=0.08
-        )
-        
-        row_idx = 1
-        
-        # Graphique Puissance
-        if "Puissance" in graphs_to_show:
-            fig.add_trace(
-                go.Scatter(
-                    x=df["time"], 
-                    y=df["cons"], 
-                    name="Consommation",
-                    line=dict(color='#f59e0b', width=2),
-                    fill='tozeroy',
-                    fillcolor='rgba(245, 158, 11, 0.2)'
-                ), 
-                row=row_idx, col=1
-            )
-            fig.add_trace(
-                go.Scatter(
-                    x=df["time"], 
-                    y=df["pv"], 
-                    name="Production PV",
-                    line=dict(color='#10b981', width=2),
-                    fill='tozeroy',
-                    fillcolor='rgba(16, 185, 129, 0.2)'
-                ), 
-                row=row_idx, col=1
+        bounds = chart_window("resultats")  # séries réduites à la largeur d'écran (LTTB)
+        def build_timeline():
+            fig = make_subplots(
+                rows=num_graphs, 
+                cols=1, 
+                shared_xaxes=True,
+                subplot_titles=tuple(graphs_to_show),
+                vertical_spacing=0.08
             )
-            fig.update_yaxes(title_text="Puissance (kW)", row=row_idx, col=1)
-            row_idx += 1
         
-        # Graphique Batterie
-        if "Batterie" in graphs_to_show:
-            fig.add_trace(
-                go.Scatter(
-                    x=df["time"], 
-                    y=df["battery"], 
-                    name="État Batterie",
-                    line=dict(color='#00f5ff', width=2.5),
-                    fill='tozeroy',
-                    fillcolor='rgba(0, 245, 255, 0.2)'
-                ), 
-                row=row_idx, col=1
-            )
-            fig.update_yaxes(title_text="Énergie (kWh)", row=row_idx, col=1)
-            row_idx += 1
+            row_idx = 1
         
-        # Graphique Température
-        if "Température" in graphs_to_show:
-            fig.add_trace(
-                go.Scatter(
-                    x=df["time"], 
-                    y=df["temp"], 
-                    name="Température Intérieure",
-                    line=dict(color='#f72585', width=2),
-                    fill='tozeroy',
-                    fillcolor='rgba(247, 37, 133, 0.2)'
-                ), 
-                row=row_idx, col=1
-            )
-            # Ligne température cible
-            if "temp_target" in st.session_state.config:
-                fig.add_hline(
-                    y=st.session_state.config["temp_target"],
-                    line_dash="dash",
-                    line_color="rgba(100, 100, 100, 0.5)",
-                    row=row_idx, col=1,
-                    annotation_text="Cible"
+            # Graphique Puissance
+            if "Puissance" in graphs_to_show:
+                fig.add_trace(
+                    line_trace(
+                        df["time"], 
+                        df["cons"], 
+                        bounds,
+                        name="Consommation",
+                        line=dict(color='#f59e0b', width=2),
+                        fill='tozeroy',
+                        fillcolor='rgba(245, 158, 11, 0.2)'
+                    ), 
+                    row=row_idx, col=1
+                )
+                fig.add_trace(
+                    line_trace(
+                        df["time"], 
+                        df["pv"], 
+                        bounds,
+                        name="Production PV",
+                        line=dict(color='#10b981', width=2),
+                        fill='tozeroy',
+                        fillcolor='rgba(16, 185, 129, 0.2)'
+                    ), 
+                    row=row_idx, col=1
                 )
-            fig.update_yaxes(title_text="Température (°C)", row=row_idx, col=1)
-            row_idx += 1
+                fig.update_yaxes(title_text="Puissance (kW)", row=row_idx, col=1)
+                row_idx += 1
         
-        # Graphique Trading
-        if "Trading" in graphs_to_show:
-            colors = ['#10b981' if x >= 0 else '#f72585' for x in df["trade"]]
-            fig.add_trace(
-                go.Bar(
-                    x=df["time"], 
-                    y=df["trade"], 
-                    name="Échanges P2P",
-                    marker_color=colors,
-                    hovertemplate='<b>%{y:.2f} kWh</b><extra></extra>'
-                ), 
-                row=row_idx, col=1
-            )
-            fig.update_yaxes(title_text="Énergie échangée (kWh)", row=row_idx, col=1)
+            # Graphique Batterie
+            if "Batterie" in graphs_to_show:
+                fig.add_trace(
+                    line_trace(
+                        df["time"], 
+                        df["battery"], 
+                        bounds,
+                        name="État Batterie",
+                        line=dict(color='#00f5ff', width=2.5),
+                        fill='tozeroy',
+                        fillcolor='rgba(0, 245, 255, 0.2)'
+                    ), 
+                    row=row_idx, col=1
+                )
+                fig.update_yaxes(title_text="Énergie (kWh)", row=row_idx, col=1)
+                row_idx += 1
         
-        # Configuration globale du layout avec FOND BLANC
-        fig.update_layout(
-            height=300 * num_graphs,
-            template="plotly_white",  # Changé de plotly_dark à plotly_white
-            showlegend=True,
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            ),
-            hovermode='x unified',
-            plot_bgcolor='white',  # Fond blanc
-            paper_bgcolor='white'  # Fond blanc
-        )
+            # Graphique Température
+            if "Température" in graphs_to_show:
+                fig.add_trace(
+                    line_trace(
+                        df["time"], 
+                        df["temp"], 
+                        bounds,
+                        name="Température Intérieure",
+                        line=dict(color='#f72585', width=2),
+                        fill='tozeroy',
+                        fillcolor='rgba(247, 37, 133, 0.2)'
+                    ), 
+                    row=row_idx, col=1
+                )
+                # Ligne température cible
+                if "temp_target" in st.session_state.config:
+                    fig.add_hline(
+                        y=st.session_state.config["temp_target"],
+                        line_dash="dash",
+                        line_color="rgba(100, 100, 100, 0.5)",
+                        row=row_idx, col=1,
+                        annotation_text="Cible"
+                    )
+                fig.update_yaxes(title_text="Température (°C)", row=row_idx, col=1)
+                row_idx += 1
+        
+            # Graphique Trading
+            if "Trading" in graphs_to_show:
+                fig.add_trace(
+                    bar_trace(
+                        df["time"], 
+                        df["trade"], 
+                        bounds,
+                        name="Échanges P2P",
+                        colors=('#10b981', '#f72585'),
+                        hovertemplate='<b>%{y:.2f} kWh</b><extra></extra>'
+                    ), 
+                    row=row_idx, col=1
+                )
+                fig.update_yaxes(title_text="Énergie échangée (kWh)", row=row_idx, col=1)
         
-        fig.update_xaxes(title_text="Temps (heures)", row=num_graphs, col=1)
+            # Configuration globale du layout avec FOND BLANC
+            fig.update_layout(
+                height=300 * num_graphs,
+                template="plotly_white",  # Changé de plotly_dark à plotly_white
+                showlegend=True,
+                legend=dict(
+                    orientation="h",
+                    yanchor="bottom",
+                    y=1.02,
+                    xanchor="right",
+                    x=1
+                ),
+                hovermode='x unified',
+                plot_bgcolor='white',  # Fond blanc
+                paper_bgcolor='white'  # Fond blanc
+            )
         
-        st.plotly_chart(fig, use_container_width=True)
+            fig.update_xaxes(title_text="Temps (heures)", row=num_graphs, col=1)
+            return fig
+
+        fig = cached_figure(st.session_state.get("result_hash"), "resultats", ("temporel", tuple(graphs_to_show), bounds), build_timeline)
+        zoomable_chart(fig, "resultats")
     else:
         st.info("🔍 Sélectionnez au moins un graphique à afficher")
     
@@ -1131,67 +1272,70 @@ elif page == "Trading" and "results" in st.session_state:
     st.markdown("---")
     
     # Graphique principal avec deux axes Y
-    fig = make_subplots(
-        specs=[[{"secondary_y": True}]],
-        subplot_titles=["Évolution du Marché Énergétique P2P"]
-    )
+    def build_market():
+        fig = make_subplots(
+            specs=[[{"secondary_y": True}]],
+            subplot_titles=["Évolution du Marché Énergétique P2P"]
+        )
     
-    # Prix (axe principal)
-    fig.add_trace(
-        go.Scatter(
-            x=df["time"], 
-            y=df["price"], 
-            name=f"Prix ({currency}/kWh)",
-            line=dict(color="#f72585", width=3),
-            fill='tozeroy',
-            fillcolor='rgba(247, 37, 133, 0.1)',
-            hovertemplate='<b>Prix</b>: %{y:.4f} ' + currency + '/kWh<br><b>Heure</b>: %{x}<extra></extra>'
-        ),
-        secondary_y=False
-    )
+        # Prix (axe principal)
+        fig.add_trace(
+            go.Scatter(
+                x=df["time"], 
+                y=df["price"], 
+                name=f"Prix ({currency}/kWh)",
+                line=dict(color="#f72585", width=3),
+                fill='tozeroy',
+                fillcolor='rgba(247, 37, 133, 0.1)',
+                hovertemplate='<b>Prix</b>: %{y:.4f} ' + currency + '/kWh<br><b>Heure</b>: %{x}<extra></extra>'
+            ),
+            secondary_y=False
+        )
     
-    # Volume (axe secondaire)
-    fig.add_trace(
-        go.Bar(
-            x=df["time"], 
-            y=df["trade"], 
-            name="Volume Échangé (kWh)",
-            marker_color="#00f5ff",
-            opacity=0.6,
-            hovertemplate='<b>Volume</b>: %{y:.2f} kWh<br><b>Heure</b>: %{x}<extra></extra>'
-        ),
-        secondary_y=True
-    )
+        # Volume (axe secondaire)
+        fig.add_trace(
+            go.Bar(
+                x=df["time"], 
+                y=df["trade"], 
+                name="Volume Échangé (kWh)",
+                marker_color="#00f5ff",
+                opacity=0.6,
+                hovertemplate='<b>Volume</b>: %{y:.2f} kWh<br><b>Heure</b>: %{x}<extra></extra>'
+            ),
+            secondary_y=True
+        )
     
-    # Ligne de prix moyen
-    fig.add_hline(
-        y=avg_price, 
-        line_dash="dash", 
-        line_color="#fbbf24",
-        annotation_text=f"Prix Moyen: {avg_price:.3f} {currency}/kWh",
-        annotation_position="top right",
-        secondary_y=False
-    )
+        # Ligne de prix moyen
+        fig.add_hline(
+            y=avg_price, 
+            line_dash="dash", 
+            line_color="#fbbf24",
+            annotation_text=f"Prix Moyen: {avg_price:.3f} {currency}/kWh",
+            annotation_position="top right",
+            secondary_y=False
+        )
     
-    fig.update_xaxes(title_text="Temps", showgrid=True, gridcolor='rgba(255,255,255,0.1)')
-    fig.update_yaxes(title_text=f"<b>Prix ({currency}/kWh)</b>", secondary_y=False, showgrid=True, gridcolor='rgba(255,255,255,0.1)')
-    fig.update_yaxes(title_text="<b>Volume (kWh)</b>", secondary_y=True, showgrid=False)
-    
-    fig.update_layout(
-        height=550,
-        template="plotly_dark",
-        hovermode='x unified',
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1
-        ),
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)'
-    )
+        fig.update_xaxes(title_text="Temps", showgrid=True, gridcolor='rgba(255,255,255,0.1)')
+        fig.update_yaxes(title_text=f"<b>Prix ({currency}/kWh)</b>", secondary_y=False, showgrid=True, gridcolor='rgba(255,255,255,0.1)')
+        fig.update_yaxes(title_text="<b>Volume (kWh)</b>", secondary_y=True, showgrid=False)
     
+        fig.update_layout(
+            height=550,
+            template="plotly_dark",
+            hovermode='x unified',
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1
+            ),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)'
+        )
+        return fig
+
+    fig = cached_figure(st.session_state.get("result_hash"), "trading", ("marche", currency), build_market)
     st.plotly_chart(fig, use_container_width=True)
     
     # Analyse des périodes de trading
@@ -1202,7 +1346,7 @@ elif page == "Trading" and "results" in st.session_state:
     with col1:
         # Répartition des volumes par tranche horaire
         df_copy = df.copy()
-        df_copy['hour'] = pd.to_datetime(df_copy['time']).dt.hour
+        df_copy['hour'] = df_copy['time'] % 24  # time = heures écoulées depuis le début de la simulation
         hourly_trade = df_copy.groupby('hour')['trade'].sum().reset_index()
         
         fig_hourly = go.Figure(data=[
@@ -1255,6 +1399,32 @@ elif page == "Trading" and "results" in st.session_state:
         
         st.plotly_chart(fig_price_dist, use_container_width=True)
     
+    # Nouveau: Règlements P2P par bâtiment (enchère double, prix uniforme par heure)
+    settlements = st.session_state.get("settlements")
+    if settlements is not None:
+        st.markdown("### 🤝 Règlements par Bâtiment")
+        active = settlements[(settlements["sold_kwh"] > 0) | (settlements["bought_kwh"] > 0)]
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Pairs actifs", f"{len(active)} / {len(settlements)}")
+        col2.metric("Heures avec échange", f"{int((df['trade'] > 0).sum())} h")
+        col3.metric("Montant échangé", f"{settlements['revenue'].sum():.2f} {currency}")
+        st.dataframe(
+            settlements.sort_values("net_settlement", ascending=False).round(3),
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "building": "Bâtiment",
+                "sold_kwh": "Vendu (kWh)",
+                "bought_kwh": "Acheté (kWh)",
+                "revenue": f"Recettes ({currency})",
+                "cost": f"Dépenses ({currency})",
+                "net_settlement": f"Solde ({currency})",
+                "avg_price": f"Prix moyen ({currency}/kWh)",
+            },
+        )
+    elif st.session_state.config.get("enable_trading"):
+        st.caption("Marché P2P : au moins deux bâtiments sont nécessaires pour échanger entre pairs")
+
     # Alerte si économies importantes
     if savings > 10:
         st.markdown(f'''
@@ -1332,7 +1502,7 @@ elif page == "Météo":
             </div>
         ''', unsafe_allow_html=True)
         
-        weather = fetch_seasonal_weather(lat, lon, season)
+        weather = seasonal_weather(lat, lon, season, st.session_state.config.get("seed"))
         df_w = pd.DataFrame({
             "Heure": range(len(weather["temp"])),
             "Température (°C)": weather["temp"],
@@ -1340,98 +1510,104 @@ elif page == "Météo":
         })
 
         # Graphiques avec style amélioré
-        fig = make_subplots(
-            rows=2, cols=1,
-            subplot_titles=(
-                "🌡️ Température extérieure", 
-                "☀️ Irradiation solaire (W/m²)"
-            ),
-            vertical_spacing=0.15
-        )
+        bounds = chart_window("meteo")
+        def build_weather():
+            fig = make_subplots(
+                rows=2, cols=1,
+                subplot_titles=(
+                    "🌡️ Température extérieure", 
+                    "☀️ Irradiation solaire (W/m²)"
+                ),
+                vertical_spacing=0.15
+            )
 
-        # Température avec gradient
-        fig.add_trace(
-            go.Scatter(
-                x=df_w["Heure"],
-                y=df_w["Température (°C)"],
-                name="Température",
-                mode='lines',
-                line=dict(
-                    color='#f72585', 
-                    width=4,
-                    shape='spline'
+            # Température avec gradient
+            fig.add_trace(
+                line_trace(
+                    df_w["Heure"],
+                    df_w["Température (°C)"],
+                    bounds,
+                    name="Température",
+                    mode='lines',
+                    line=dict(
+                        color='#f72585', 
+                        width=4,
+                        shape='spline'
+                    ),
+                    fill='tozeroy',
+                    fillcolor='rgba(247, 37, 133, 0.2)',
+                    hovertemplate='<b>Heure:</b> %{x}h<br><b>Température:</b> %{y:.1f}°C<extra></extra>'
                 ),
-                fill='tozeroy',
-                fillcolor='rgba(247, 37, 133, 0.2)',
-                hovertemplate='<b>Heure:</b> %{x}h<br><b>Température:</b> %{y:.1f}°C<extra></extra>'
-            ),
-            row=1, col=1
-        )
+                row=1, col=1
+            )
 
-        # Irradiation avec gradient cyan
-        fig.add_trace(
-            go.Scatter(
-                x=df_w["Heure"],
-                y=df_w["Irradiation (W/m²)"],
-                name="Irradiation",
-                mode='lines',
-                line=dict(
-                    color='#00f5ff', 
-                    width=4,
-                    shape='spline'
+            # Irradiation avec gradient cyan
+            fig.add_trace(
+                line_trace(
+                    df_w["Heure"],
+                    df_w["Irradiation (W/m²)"],
+                    bounds,
+                    name="Irradiation",
+                    mode='lines',
+                    line=dict(
+                        color='#00f5ff', 
+                        width=4,
+                        shape='spline'
+                    ),
+                    fill='tozeroy',
+                    fillcolor='rgba(0, 245, 255, 0.3)',
+                    hovertemplate='<b>Heure:</b> %{x}h<br><b>Irradiation:</b> %{y:.0f} W/m²<extra></extra>'
                 ),
-                fill='tozeroy',
-                fillcolor='rgba(0, 245, 255, 0.3)',
-                hovertemplate='<b>Heure:</b> %{x}h<br><b>Irradiation:</b> %{y:.0f} W/m²<extra></extra>'
-            ),
-            row=2, col=1
-        )
+                row=2, col=1
+            )
 
-        fig.update_layout(
-            height=700,
-            template="plotly_white",
-            showlegend=False,
-            margin=dict(l=50, r=50, t=100, b=50),
-            paper_bgcolor='white',
-            plot_bgcolor='#f8f9fa',
-            font=dict(size=13, color='#2c3e50'),
-            hoverlabel=dict(
-                bgcolor="white",
-                font_size=14,
-                font_family="Arial",
-                font_color="#2c3e50"
-            ),
-            title_font=dict(size=16, color='#2c3e50', family="Arial")
-        )
+            fig.update_layout(
+                height=700,
+                template="plotly_white",
+                showlegend=False,
+                margin=dict(l=50, r=50, t=100, b=50),
+                paper_bgcolor='white',
+                plot_bgcolor='#f8f9fa',
+                font=dict(size=13, color='#2c3e50'),
+                hoverlabel=dict(
+                    bgcolor="white",
+                    font_size=14,
+                    font_family="Arial",
+                    font_color="#2c3e50"
+                ),
+                title_font=dict(size=16, color='#2c3e50', family="Arial")
+            )
         
-        # Style des sous-titres en blanc
-        for annotation in fig['layout']['annotations']:
-            annotation['font'] = dict(size=16, color='#2c3e50', family="Arial")
-        
-        # Style des axes
-        fig.update_xaxes(
-            title_text="⏰ Heure", 
-            row=2, col=1,
-            gridcolor='rgba(0,0,0,0.1)',
-            showgrid=True,
-            title_font=dict(color='#2c3e50')
-        )
-        fig.update_yaxes(
-            title_text="°C", 
-            row=1, col=1,
-            gridcolor='rgba(0,0,0,0.1)',
-            showgrid=True,
-            title_font=dict(color='#2c3e50')
-        )
-        fig.update_yaxes(
-            title_text="W/m²", 
-            row=2, col=1,
-            gridcolor='rgba(0,0,0,0.1)',
-            showgrid=True,
-            title_font=dict(color='#2c3e50')
-        )
+            # Style des sous-titres en blanc
+            for annotation in fig['layout']['annotations']:
+                annotation['font'] = dict(size=16, color='#2c3e50', family="Arial")
+        
+            # Style des axes
+            fig.update_xaxes(
+                title_text="⏰ Heure", 
+                row=2, col=1,
+                gridcolor='rgba(0,0,0,0.1)',
+                showgrid=True,
+                title_font=dict(color='#2c3e50')
+            )
+            fig.update_yaxes(
+                title_text="°C", 
+                row=1, col=1,
+                gridcolor='rgba(0,0,0,0.1)',
+                showgrid=True,
+                title_font=dict(color='#2c3e50')
+            )
+            fig.update_yaxes(
+                title_text="W/m²", 
+                row=2, col=1,
+                gridcolor='rgba(0,0,0,0.1)',
+                showgrid=True,
+                title_font=dict(color='#2c3e50')
+            )
+            return fig
 
-        st.plotly_chart(fig, use_container_width=True)
+        fig = cached_figure(weather_hash(lat, lon, season), "meteo", ("saison", bounds), build_weather)
+        zoomable_chart(fig, "meteo")
 
         # KPI météo avec style moderne
         st.markdown("<br>", unsafe_allow_html=True)
@@ -1456,7 +1632,7 @@ elif page == "Météo":
             ''', unsafe_allow_html=True)
         
         with col2:
-            irrad_max = max(weather['solar'])
+            irrad_max = weather['solar'].max()
             st.markdown(f'''
                 <div style="
                     background: #ffffff;
@@ -1513,7 +1689,7 @@ elif page == "Batterie" and "results" in st.session_state:
     
     df = st.session_state.last_results
     config = st.session_state.config
-    total_capacity = config["battery_capacity"] * len(config["buildings"])
+    total_capacity = total_battery_capacity(config)
     
     # Métriques principales
     final_soc = df["soc"].iloc[-1]
@@ -1542,80 +1718,81 @@ elif page == "Batterie" and "results" in st.session_state:
     st.markdown("---")
     
     # Graphique principal du SOC
-    fig = go.Figure()
-    
-    # Zone de sécurité (20-80%)
-    fig.add_hrect(
-        y0=total_capacity * 0.2, 
-        y1=total_capacity * 0.8,
-        fillcolor="rgba(16, 185, 129, 0.1)",
-        layer="below",
-        line_width=0,
-        annotation_text="Zone Optimale",
-        annotation_position="top right"
-    )
-    
-    # Courbe du SOC avec gradient de couleur
-    colors = ['#ef4444' if soc < total_capacity * 0.2 
-              else '#10b981' if soc > total_capacity * 0.8 
-              else '#a78bfa' for soc in df["soc"]]
-    
-    fig.add_trace(go.Scatter(
-        x=df["time"], 
-        y=df["soc"], 
-        name="State of Charge",
-        line=dict(color="#a78bfa", width=4),
-        fill='tozeroy',
-        fillcolor='rgba(167, 139, 250, 0.2)',
-        mode='lines',
-        hovertemplate='<b>SOC</b>: %{y:.2f} kWh<br><b>Temps</b>: %{x}<br><b>Niveau</b>: %{text}<extra></extra>',
-        text=[f"{(soc/total_capacity*100):.1f}%" for soc in df["soc"]]
-    ))
+    bounds = chart_window("batterie")
+    def build_soc():
+        fig = go.Figure()
+    
+        # Zone de sécurité (20-80%)
+        fig.add_hrect(
+            y0=total_capacity * 0.2, 
+            y1=total_capacity * 0.8,
+            fillcolor="rgba(16, 185, 129, 0.1)",
+            layer="below",
+            line_width=0,
+            annotation_text="Zone Optimale",
+            annotation_position="top right"
+        )
     
-    # Lignes de seuil
-    fig.add_hline(
-        y=total_capacity * 0.2, 
-        line_dash="dash", 
-        line_color="#ef4444",
-        line_width=2,
-        annotation_text="⚠️ 20% - Seuil Minimal",
-        annotation_position="right"
-    )
+        # Courbe du SOC (réduite à la largeur d'écran, niveau % formaté sur les seuls points affichés)
+        fig.add_trace(line_trace(
+            df["time"], 
+            df["soc"], 
+            bounds,
+            name="State of Charge",
+            line=dict(color="#a78bfa", width=4),
+            fill='tozeroy',
+            fillcolor='rgba(167, 139, 250, 0.2)',
+            mode='lines',
+            hovertemplate='<b>SOC</b>: %{y:.2f} kWh<br><b>Temps</b>: %{x}<br><b>Niveau</b>: %{text}<extra></extra>',
+            text=lambda soc: np.char.mod("%.1f%%", soc / total_capacity * 100) if total_capacity > 0 else None
+        ))
     
-    fig.add_hline(
-        y=total_capacity * 0.8, 
-        line_dash="dash", 
-        line_color="#10b981",
-        line_width=2,
-        annotation_text="✓ 80% - Charge Optimale",
-        annotation_position="right"
-    )
+        # Lignes de seuil
+        fig.add_hline(
+            y=total_capacity * 0.2, 
+            line_dash="dash", 
+            line_color="#ef4444",
+            line_width=2,
+            annotation_text="⚠️ 20% - Seuil Minimal",
+            annotation_position="right"
+        )
     
-    # Ligne de capacité maximale
-    fig.add_hline(
-        y=total_capacity, 
-        line_dash="dot", 
-        line_color="#fbbf24",
-        line_width=2,
-        annotation_text=f"Capacité Max: {total_capacity:.1f} kWh",
-        annotation_position="left"
-    )
+        fig.add_hline(
+            y=total_capacity * 0.8, 
+            line_dash="dash", 
+            line_color="#10b981",
+            line_width=2,
+            annotation_text="✓ 80% - Charge Optimale",
+            annotation_position="right"
+        )
     
-    fig.update_layout(
-        title="Évolution du State of Charge (SOC)",
-        xaxis_title="Temps",
-        yaxis_title="Énergie Stockée (kWh)",
-        height=500,
-        template="plotly_dark",
-        hovermode='x unified',
-        plot_bgcolor='rgba(0,0,0,0.0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        showlegend=True
-    )
+        # Ligne de capacité maximale
+        fig.add_hline(
+            y=total_capacity, 
+            line_dash="dot", 
+            line_color="#fbbf24",
+            line_width=2,
+            annotation_text=f"Capacité Max: {total_capacity:.1f} kWh",
+            annotation_position="left"
+        )
     
-    fig.update_yaxes(range=[0, total_capacity * 1.1])
+        fig.update_layout(
+            title="Évolution du State of Charge (SOC)",
+            xaxis_title="Temps",
+            yaxis_title="Énergie Stockée (kWh)",
+            height=500,
+            template="plotly_dark",
+            hovermode='x unified',
+            plot_bgcolor='rgba(0,0,0,0.0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            showlegend=True
+        )
     
-    st.plotly_chart(fig, use_container_width=True)
+        fig.update_yaxes(range=[0, total_capacity * 1.1])
+        return fig
+
+    fig = cached_figure(st.session_state.get("result_hash"), "batterie", ("soc", bounds), build_soc)
+    zoomable_chart(fig, "batterie")
     
     # Analyse détaillée
     st.markdown("### 📈 Analyse de Performance")
@@ -1701,6 +1878,37 @@ elif page == "Batterie" and "results" in st.session_state:
         
         st.plotly_chart(fig_gauge, use_container_width=True)
     
+    # Nouveau: Vieillissement (rainflow sur le SOC + vieillissement calendaire), calculé pendant la simulation
+    kpis = st.session_state.get("kpis") or {}
+    if "capacity_fade_pct" in kpis:
+        st.markdown("### 🧪 Vieillissement de la Batterie")
+        currency = get_currency(config.get("country_code", 'FR'))
+        fade = kpis["capacity_fade_pct"]
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Cycles Équivalents", f"{kpis['equivalent_full_cycles']:.1f}",
+                    help="Somme des profondeurs des cycles comptés par rainflow (1 = une charge/décharge complète)")
+        col2.metric("Perte de Capacité", f"{fade:.2f}%", delta=f"-{total_capacity * fade / 100:.2f} kWh", delta_color="inverse")
+        col3.metric("Capacité Restante", f"{total_capacity * (1 - fade / 100):.1f} kWh")
+        col4.metric("Coût d'Usure", f"{kpis['degradation_cost']:.2f} {currency}",
+                    help="Part de la durée de vie consommée × coût de remplacement de la batterie")
+        st.caption("Vieillissement cyclique (profondeur et SOC moyen de chaque cycle) + calendaire (durée et SOC de stockage). Non inclus dans le coût total.")
+    
+    # Nouveau: Facture réseau au tarif horaire, critère du pilotage MPC
+    if "grid_cost" in kpis:
+        st.markdown("### 🧾 Facture Réseau")
+        currency = get_currency(config.get("country_code", 'FR'))
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Coût Réseau", f"{kpis['grid_cost']:.2f} {currency}",
+                    help="Achats au tarif horaire (creuses / pleines / pointe) − reventes du surplus, après batterie")
+        col2.metric("Pilotage", "MPC" if config.get("dispatch") == "mpc" else "Règle")
+        if pd.notna(kpis.get("optimal_grid_cost", np.nan)):
+            col3.metric("Optimum (information parfaite)", f"{kpis['optimal_grid_cost']:.2f} {currency}",
+                        delta=f"{kpis['gap_to_optimal']:+.2f} {currency} ({kpis['gap_to_optimal_pct']:+.1f}%)", delta_color="inverse",
+                        help="Programmation dynamique sur une grille de SOC : meilleure trajectoire possible connaissant toute la série à l'avance")
+            st.caption("Écart à l'optimum : coût réseau du pilotage choisi − coût optimal. Un léger écart négatif vient de la discrétisation du SOC.")
+        else:
+            col3.caption("Optimum non calculé : cochez « Comparer à l'optimum » dans la Configuration.")
+    
     # Alertes et recommandations
     st.markdown("### 💡 Recommandations")
     
@@ -1760,17 +1968,17 @@ elif page == "Prévisions":
             """, unsafe_allow_html=True)
             
             with st.spinner("🔄 Génération des prévisions saisonnières en cours..."):
-                weather = fetch_seasonal_weather(lat, lon, season)
+                weather = seasonal_weather(lat, lon, season, st.session_state.config.get("seed"))
                 
                 # Sur 90 jours (2160 heures)
-                hours = list(range(2160))
                 temp = weather["temp"]
                 solar = weather["solar"]
+                hours = np.arange(len(temp))
                 
                 df_forecast = pd.DataFrame({
                     "Heure": hours,
-                    "Température (°C)": [round(t, 1) for t in temp],
-                    "Irradiation (W/m²)": [round(s) for s in solar]
+                    "Température (°C)": np.round(temp, 1),
+                    "Irradiation (W/m²)": np.round(solar)
                 })
                 
                 # Calcul des statistiques
@@ -1800,71 +2008,77 @@ elif page == "Prévisions":
                 st.markdown("---")
                 
                 # Graphiques améliorés avec double-axe
-                fig = make_subplots(
-                    rows=2, cols=1,
-                    subplot_titles=(
-                        "📊 Température Prévue sur 90 Jours", 
-                        "☀️ Irradiation Solaire Prévue sur 90 Jours"
-                    ),
-                    vertical_spacing=0.15,
-                    row_heights=[0.5, 0.5]
-                )
-                
-                # Graphique Température
-                fig.add_trace(
-                    go.Scatter(
-                        x=df_forecast["Heure"], 
-                        y=df_forecast["Température (°C)"], 
-                        mode='lines',
-                        line=dict(color="#f72585", width=2),
-                        fill='tozeroy',
-                        fillcolor='rgba(247, 37, 133, 0.15)',
-                        name="Température",
-                        hovertemplate='<b>Heure %{x}</b><br>Temp: %{y:.1f}°C<extra></extra>'
-                    ), 
-                    row=1, col=1
-                )
+                bounds = chart_window("previsions")
+                def build_forecast():
+                    fig = make_subplots(
+                        rows=2, cols=1,
+                        subplot_titles=(
+                            "📊 Température Prévue sur 90 Jours", 
+                            "☀️ Irradiation Solaire Prévue sur 90 Jours"
+                        ),
+                        vertical_spacing=0.15,
+                        row_heights=[0.5, 0.5]
+                    )
                 
-                # Lignes de référence température
-                fig.add_hline(y=temp_avg, line_dash="dash", line_color="#fbbf24", 
-                              annotation_text=f"Moy: {temp_avg:.1f}°C", 
-                              annotation_position="right", row=1, col=1)
+                    # Graphique Température
+                    fig.add_trace(
+                        line_trace(
+                            df_forecast["Heure"], 
+                            df_forecast["Température (°C)"], 
+                            bounds,
+                            mode='lines',
+                            line=dict(color="#f72585", width=2),
+                            fill='tozeroy',
+                            fillcolor='rgba(247, 37, 133, 0.15)',
+                            name="Température",
+                            hovertemplate='<b>Heure %{x}</b><br>Temp: %{y:.1f}°C<extra></extra>'
+                        ), 
+                        row=1, col=1
+                    )
                 
-                # Graphique Irradiation Solaire
-                fig.add_trace(
-                    go.Scatter(
-                        x=df_forecast["Heure"], 
-                        y=df_forecast["Irradiation (W/m²)"], 
-                        mode='lines',
-                        fill='tozeroy',
-                        fillcolor='rgba(0, 245, 255, 0.25)',
-                        line=dict(color="#00f5ff", width=2),
-                        name="Irradiation",
-                        hovertemplate='<b>Heure %{x}</b><br>Irrad: %{y:.0f} W/m²<extra></extra>'
-                    ), 
-                    row=2, col=1
-                )
+                    # Lignes de référence température
+                    fig.add_hline(y=temp_avg, line_dash="dash", line_color="#fbbf24", 
+                                  annotation_text=f"Moy: {temp_avg:.1f}°C", 
+                                  annotation_position="right", row=1, col=1)
                 
-                # Ligne de référence solaire
-                fig.add_hline(y=solar_avg, line_dash="dash", line_color="#fbbf24",
-                              annotation_text=f"Moy: {solar_avg:.0f} W/m²",
-                              annotation_position="right", row=2, col=1)
+                    # Graphique Irradiation Solaire
+                    fig.add_trace(
+                        line_trace(
+                            df_forecast["Heure"], 
+                            df_forecast["Irradiation (W/m²)"], 
+                            bounds,
+                            mode='lines',
+                            fill='tozeroy',
+                            fillcolor='rgba(0, 245, 255, 0.25)',
+                            line=dict(color="#00f5ff", width=2),
+                            name="Irradiation",
+                            hovertemplate='<b>Heure %{x}</b><br>Irrad: %{y:.0f} W/m²<extra></extra>'
+                        ), 
+                        row=2, col=1
+                    )
                 
-                fig.update_xaxes(title_text="Heures (0 = maintenant, 2160 = +90 jours)", row=2, col=1)
-                fig.update_xaxes(title_text="", row=1, col=1)
-                fig.update_yaxes(title_text="Température (°C)", row=1, col=1)
-                fig.update_yaxes(title_text="Irradiation (W/m²)", row=2, col=1)
+                    # Ligne de référence solaire
+                    fig.add_hline(y=solar_avg, line_dash="dash", line_color="#fbbf24",
+                                  annotation_text=f"Moy: {solar_avg:.0f} W/m²",
+                                  annotation_position="right", row=2, col=1)
                 
-                fig.update_layout(
-                    height=700,
-                    template="plotly_dark",
-                    showlegend=False,
-                    hovermode='x unified',
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)'
-                )
+                    fig.update_xaxes(title_text="Heures (0 = maintenant, 2160 = +90 jours)", row=2, col=1)
+                    fig.update_xaxes(title_text="", row=1, col=1)
+                    fig.update_yaxes(title_text="Température (°C)", row=1, col=1)
+                    fig.update_yaxes(title_text="Irradiation (W/m²)", row=2, col=1)
                 
-                st.plotly_chart(fig, use_container_width=True)
+                    fig.update_layout(
+                        height=700,
+                        template="plotly_dark",
+                        showlegend=False,
+                        hovermode='x unified',
+                        plot_bgcolor='rgba(0,0,0,0)',
+                        paper_bgcolor='rgba(0,0,0,0)'
+                    )
+                    return fig
+
+                fig = cached_figure(weather_hash(lat, lon, season), "previsions", ("saison", bounds), build_forecast)
+                zoomable_chart(fig, "previsions")
                 
                 # Analyse par semaine
                 st.markdown("### 📅 Analyse par Semaine")
@@ -2052,7 +2266,7 @@ elif page == "Prévisions":
                 </div>
                 """, unsafe_allow_html=True)
 # =====================================
-# PRÉDICTIONS IA (simulation simple mais réaliste – sans modèle lourd)
+# PRÉDICTIONS IA (régression scikit-learn entraînée sur les runs archivés)
 # =====================================
 elif page == "Prédictions":
     st.markdown("<h1>🤖 Prédictions IA • 24h à venir</h1>", unsafe_allow_html=True)
@@ -2063,17 +2277,15 @@ elif page == "Prédictions":
     
     df = st.session_state.last_results
     
-    # Simulation simple de prédiction (basée sur moyenne glissante + saisonnalité)
-    recent_cons = df["cons"].tail(24).values
-    base = np.mean(recent_cons)
-    
-    # Ajout d'une petite variation réaliste
-    pred = []
-    for i in range(24):
-        heure = (datetime.datetime.now().hour + i) % 24
-        saison = 1 + 0.3 * np.sin(2 * np.pi * heure / 24)  # pic le soir
-        bruit = np.random.normal(0, 0.8)
-        pred.append(round(base * saison + bruit, 2))
+    # Nouveau: Prévision du modèle (calendrier + météo du run + retards), mémorisée par hash du résultat
+    result_hash = st.session_state.get("result_hash") or uuid.uuid4().hex
+    forecast = consumption_forecast(result_hash, df, st.session_state.config)
+    if forecast is None:
+        st.info("⚡ Simulation trop courte pour la prévision : il faut plus de 48 heures d'historique ou un run archivé.")
+        st.stop()
+    pred = [round(float(p), 2) for p in forecast["pred"]]
+    st.caption(f"Modèle entraîné sur {forecast['runs']} run(s) ({forecast['samples']:,} heures) • variables : heure, jour, température, ensoleillement, consommation J-1 et J-2")
+    st.caption("Bande P10–P90 : 8 heures sur 10 attendues dans l'intervalle (gradient boosting à perte quantile, un modèle par quantile, 24 h prédites en un appel)")
     
     heures_futures = [f"+{i}h" for i in range(1, 25)]
     
@@ -2105,7 +2317,7 @@ elif page == "Prédictions":
     # Graphique principal amélioré
     fig = make_subplots(
         rows=1, cols=1,
-        subplot_titles=["Prédiction de Consommation - Modèle IA Léger Embarqué"]
+        subplot_titles=["Prédiction de Consommation - Régression SGD (scikit-learn)"]
     )
     
     # Historique
@@ -2134,20 +2346,27 @@ elif page == "Prédictions":
         hovertemplate='<b>Prédiction</b><br>Temps: +%{x}h<br>Conso: %{y:.2f} kW<extra></extra>'
     ))
     
-    # Bandes de confiance (simulation)
-    upper_bound = [p * 1.1 for p in pred]
-    lower_bound = [p * 0.9 for p in pred]
+    # Nouveau: Intervalle P10–P90 des modèles quantiles (gradient boosting), à la place de la bande fixe ±10 %
+    upper_bound = [round(float(p), 2) for p in forecast["p90"]]
+    lower_bound = [round(float(p), 2) for p in forecast["p10"]]
     
     fig.add_trace(go.Scatter(
         x=list(range(0, 24)) + list(range(23, -1, -1)),
         y=upper_bound + lower_bound[::-1],
         fill='toself',
-        fillcolor='rgba(0, 0, 0, 0)',
+        fillcolor='rgba(0, 245, 255, 0.15)',
         line=dict(color='rgba(0,0,0,0)'),
         showlegend=True,
-        name='Intervalle de confiance (±10%)',
+        name='Intervalle P10–P90',
         hoverinfo='skip'
     ))
+    fig.add_trace(go.Scatter(
+        x=list(range(0, 24)),
+        y=forecast["p50"],
+        name="Médiane P50",
+        line=dict(color="#fbbf24", width=2, dash="dash"),
+        hovertemplate='<b>P50</b><br>Temps: +%{x}h<br>Conso: %{y:.2f} kW<extra></extra>'
+    ))
     
     # Ligne de pic prévu
     fig.add_hline(y=pred_max, line_dash="dash", line_color="#ef4444",
@@ -2227,6 +2446,8 @@ elif page == "Prédictions":
         df_pred_display = pd.DataFrame({
             "Heure": heures_futures,
             "Conso (kW)": pred,
+            "P10 (kW)": lower_bound,
+            "P90 (kW)": upper_bound,
             "Écart/Moy": [f"{((p-pred_avg)/pred_avg*100):+.1f}%" for p in pred],
             "Niveau": ["🔴 Élevé" if p > pred_avg * 1.15 
                       else "🟢 Faible" if p < pred_avg * 0.85 
@@ -2593,7 +2814,7 @@ elif page == "Optimisation":
         st.markdown("L'algorithme va tester différentes valeurs de **Kp** pour minimiser les coûts énergétiques.")
     
     with col2:
-        st.metric("Iterations", "20", help="Nombre de tests effectués")
+        n_kp = st.number_input("Iterations", min_value=5, max_value=5000, value=20, step=5, help="Nombre de valeurs de Kp testées entre 0.1 et 1.5")
     
     # Bouton d'optimisation stylisé
     if st.button("🚀 Démarrer l'optimisation", type="primary", use_container_width=True):
@@ -2611,38 +2832,45 @@ elif page == "Optimisation":
             current_cost_metric = metric_cols[1].empty()
             best_cost_metric = metric_cols[2].empty()
         
-        # Optimisation
-        best_cost = float('inf')
-        best_kp = 0.6
-        kp_values = np.linspace(0.1, 1.5, 20)
-        costs = []
-        
-        for i, kp in enumerate(kp_values):
-            # Mise à jour de la progression
-            progress = (i + 1) / len(kp_values)
-            progress_bar.progress(progress)
-            status_text.markdown(f"**Test {i+1}/20** - Évaluation en cours...")
-            
-            # Simulation
-            code = f"def control(state, t):\n    error = state['temp_target'] - state['outdoor_temp']\n    return np.clip(error * {kp:.2f}, -1, 1)"
-            temp_config = st.session_state.config.copy()
-            temp_config["control_code"] = code
-            sim = Simulator(temp_config)
-            _, kpis = sim.run()
-            
-            current_cost = kpis["total_cost"]
-            costs.append(current_cost)
-            
-            # Mise à jour des métriques
-            currency = get_currency(st.session_state.config.get("country_code", 'FR'))
-            current_kp_metric.metric("Kp actuel", f"{kp:.2f}")
-            current_cost_metric.metric("Coût actuel", f"{current_cost:.2f} {currency}")
-            
-            if current_cost < best_cost:
-                best_cost = current_cost
-                best_kp = kp
-                best_cost_metric.metric("🏆 Meilleur coût", f"{best_cost:.2f} {currency}", 
-                                       delta=f"-{((costs[0]-best_cost)/costs[0]*100):.1f}%" if i > 0 else None)
+        # Optimisation : la grille est découpée en tranches évaluées en parallèle (un run_batch par tranche)
+        kp_values = np.linspace(0.1, 1.5, int(n_kp))
+        costs = np.full(len(kp_values), np.nan)
+        currency = get_currency(st.session_state.config.get("country_code", 'FR'))
+        # Même graine pour toutes les tranches : chaque Kp est évalué sous la même météo et la même charge
+        seed = st.session_state.config.get("seed")
+        seed = np.random.SeedSequence().entropy if seed is None else seed
+        n_chunks = min(len(kp_values), (os.cpu_count() or 1) * 4)
+        chunks = np.array_split(np.arange(len(kp_values)), n_chunks)
+        
+        # Résultats au fil de l'eau, dans l'ordre de complétion
+        done = 0
+        for attempt in range(2):
+            pool = get_worker_pool()
+            try:
+                futures = {pool.submit(evaluate_kp, st.session_state.config, kp_values[idx], seed): idx for idx in chunks}
+                for future in as_completed(futures):
+                    idx = futures[future]
+                    costs[idx] = future.result()
+                    done += len(idx)
+                    progress_bar.progress(done / len(kp_values))
+                    status_text.markdown(f"**Test {done}/{len(kp_values)}** - Évaluation en cours...")
+                    
+                    best_idx = int(np.nanargmin(costs))
+                    current_kp_metric.metric("Kp actuel", f"{kp_values[idx[-1]]:.2f}")
+                    current_cost_metric.metric("Coût actuel", f"{costs[idx[-1]]:.2f} {currency}")
+                    best_cost_metric.metric("🏆 Meilleur coût", f"{costs[best_idx]:.2f} {currency}")
+                break
+            except BrokenProcessPool:
+                # Worker tué (plantage, mémoire) : le pool en cache est inutilisable, recréé pour les tranches
+                # restantes (une seule reprise, puis pour les optimisations suivantes)
+                pool.shutdown(wait=False, cancel_futures=True)
+                get_worker_pool.clear()
+                chunks = [idx for idx in chunks if np.isnan(costs[idx]).any()]
+                if attempt:
+                    raise
+        
+        best_cost = costs[best_idx]
+        best_kp = kp_values[best_idx]
         
         # Effacer la progression
         progress_container.empty()
@@ -2744,7 +2972,7 @@ elif page == "Optimisation":
             col_apply1, col_apply2, col_apply3 = st.columns([1, 2, 1])
             with col_apply2:
                 if st.button("✨ Appliquer ce contrôleur", type="primary", use_container_width=True):
-                    st.session_state.config["control_code"] = f"def control(state, t):\n    error = state['temp_target'] - state['outdoor_temp']\n    return np.clip(error * {best_kp:.2f}, -1, 1)"
+                    st.session_state.config["control_code"] = kp_control_code(best_kp)
                     st.success("✅ Contrôleur appliqué avec succès ! Rendez-vous dans l'onglet Simulation.")
     
     # Section d'information
@@ -2758,7 +2986,7 @@ elif page == "Optimisation":
             <div style='text-align: center; padding: 1rem;'>
                 <div style='font-size: 3rem;'>🔍</div>
                 <h4>Exploration</h4>
-                <p style='color: #666;'>Test de 20 valeurs différentes de Kp entre 0.1 et 1.5</p>
+                <p style='color: #666;'>Test de plusieurs valeurs de Kp entre 0.1 et 1.5, en parallèle</p>
             </div>
         """, unsafe_allow_html=True)
     
@@ -2803,8 +3031,15 @@ elif page == "Historique":
         </div>
     ''', unsafe_allow_html=True)
     
-    if "history" in st.session_state and st.session_state.history:
-        df_hist = pd.DataFrame(st.session_state.history)
+    store = get_history_store()
+    if store.count():
+        # Filtres servis par les index SQLite : seules les lignes affichées sont lues
+        col_agent, col_limit = st.columns(2)
+        with col_agent:
+            agent_filter = st.selectbox("Agent", ["Tous"] + store.agents())
+        with col_limit:
+            limit = st.number_input("Nombre de simulations affichées", min_value=10, max_value=10000, value=50, step=10)
+        df_hist = store.query(agent=None if agent_filter == "Tous" else agent_filter, limit=limit)
         currency = get_currency(st.session_state.config.get("country_code", 'FR')) if "config" in st.session_state else 'EUR'
         df_hist['cost'] = df_hist['cost'].apply(lambda x: f"{x} {currency}")
         
@@ -2812,7 +3047,7 @@ elif page == "Historique":
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            total_sims = len(df_hist)
+            total_sims = store.count()
             st.markdown(f'''
                 <div style="
                     background: #ffffff;
@@ -2830,7 +3065,7 @@ elif page == "Historique":
         
         with col2:
             if 'date' in df_hist.columns:
-                latest_date = df_hist['date'].iloc[-1] if len(df_hist) > 0 else "N/A"
+                latest_date = df_hist['date'].iloc[0] if len(df_hist) > 0 else "N/A"
                 st.markdown(f'''
                     <div style="
                         background: #ffffff;
@@ -2880,11 +3115,28 @@ elif page == "Historique":
             use_container_width=True,
             height=400
         )
+
+        # Nouveau: Séries horaires archivées, relues à la demande (colonnes et plage choisies)
+        archive = get_run_archive()
+        runs = store.query(agent=None if agent_filter == "Tous" else agent_filter, limit=limit, columns=("date", "config_hash"))
+        # Runs importés de l'ancien historique JSON : config_hash NULL (NaN pour pandas), pas d'archive
+        runs = runs[[isinstance(h, str) and h in archive for h in runs["config_hash"]]].drop_duplicates("config_hash")
+        if not runs.empty:
+            with st.expander("📦 Séries horaires archivées", expanded=False):
+                labels = {f"{row.date} • {row.config_hash[:10]}": row.config_hash for row in runs.itertuples()}
+                run_key = labels[st.selectbox("Simulation", list(labels))]
+                meta = archive.meta(run_key)
+                series = [c for c in meta["columns"] if c != "time"]
+                chosen = st.multiselect("Colonnes", series, default=series[:2])
+                hour_range = st.slider("Plage horaire", 0, meta["rows"], (0, min(meta["rows"], 168)))
+                if chosen:
+                    df_run = archive.load(run_key, columns=["time"] + chosen, start=hour_range[0], stop=hour_range[1])
+                    st.line_chart(df_run.set_index("time"))
         
         # Bouton pour effacer l'historique
         st.markdown("<br>", unsafe_allow_html=True)
         if st.button("🗑️ Effacer l'historique", type="secondary"):
-            st.session_state.history = []
+            store.clear()
             st.rerun()
     else:
         st.markdown('''
@@ -3032,30 +3284,29 @@ def render_export_buttons():
                 return
         except:
             return
-    # === EXPORT CSV + EXCEL (parfaitement propre) ===
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        csv = df.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="Exporter en CSV",
-            data=csv,
-            file_name=f"IKSOU_Pro_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv",
-            use_container_width=True
-        )
-    
-    with col2:
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Simulation IKSOU')
-        st.download_button(
-            label="Exporter en Excel",
-            data=output.getvalue(),
-            file_name=f"IKSOU_Pro_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True
-        )
+    # === EXPORTS À LA DEMANDE : générés au clic, une seule fois par résultat et par format ===
+    result_hash = st.session_state.get("result_hash") or uuid.uuid4().hex
+    stamp = pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')
+    formats = available_formats()
+    for col, fmt in zip(st.columns(len(formats)), formats):
+        label, extension, mime, _, _ = EXPORT_FORMATS[fmt]
+        with col:
+            st.download_button(
+                label=f"Exporter en {label}",
+                data=lambda fmt=fmt: get_export_cache().get_or_build((result_hash, fmt), lambda: export_bytes(df, fmt)),
+                file_name=f"IKSOU_Pro_{stamp}.{extension}",
+                mime=mime,
+                on_click="ignore",
+                key=f"export_{fmt}",
+                use_container_width=True
+            )
+    if not HAS_PYARROW:
+        st.caption("Exports Parquet / Arrow IPC disponibles après installation de pyarrow")
+
+# Nouveau: Exports générés partagés entre sessions (même résultat → même fichier)
+@st.cache_resource
+def get_export_cache():
+    return ExportCache()
 
 # Pages où afficher l'export
 pages_with_export = ["Simulation", "Résultats", "Trading", "Météo", "Batterie", "Environnement"]
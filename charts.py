@@ -0,0 +1,104 @@
+# =============================================
+# IKSOU Pro – Préparation des graphiques longues séries
+# LTTB (Largest-Triangle-Three-Buckets) à la largeur d'écran, WebGL au-delà d'un seuil
+# Fenêtre (x0, x1) : le zoom recalcule le détail depuis les tableaux complets
+# Cache LRU des figures préparées, clé = (hash du résultat, page, graphique)
+# =============================================
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import plotly.graph_objects as go
+
+CHART_WIDTH_PX = 1600  # ~1 point par pixel sur un écran large
+SCATTERGL_THRESHOLD = 1000  # au-delà, rendu WebGL (Scattergl)
+
+
+def lttb(x, y, n_out):
+    """Indices des points retenus par LTTB (premier et dernier inclus), dans l'ordre."""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    # n_out - 2 seaux sur les points intérieurs ; le dernier « seau suivant » est le dernier point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    sizes = np.diff(np.append(edges, n))
+    avg_x = np.append(np.add.reduceat(x, edges)[:-1] / sizes[:-1], x[-1])
+    avg_y = np.append(np.add.reduceat(y, edges)[:-1] / sizes[:-1], y[-1])
+    kept = np.empty(n_out, dtype=np.intp)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Aire du triangle (point retenu précédent, candidat, moyenne du seau suivant), vectorisée sur le seau
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+def window(x, bounds=None):
+    """Tranche des indices de x (trié) dans bounds = (x0, x1) ; tout x si bounds est None."""
+    if bounds is None:
+        return slice(0, len(x))
+    lo, hi = np.searchsorted(x, bounds[0], side="left"), np.searchsorted(x, bounds[1], side="right")
+    return slice(int(lo), int(max(hi, lo + 1)))
+
+
+def sample(x, y, bounds=None, width=CHART_WIDTH_PX):
+    """(x, y, indices absolus) réduits à width points dans la fenêtre bounds."""
+    x, y = np.asarray(x), np.asarray(y)
+    part = window(x, bounds)
+    idx = part.start + lttb(x[part], y[part], width)
+    return x[idx], y[idx], idx
+
+
+def line_trace(x, y, bounds=None, width=CHART_WIDTH_PX, text=None, **kwargs):
+    """Trace de ligne prête à afficher : LTTB si plus de points que de pixels, Scattergl au-delà du seuil.
+
+    text peut être une fonction des valeurs y retenues (formatage vectorisé sur les seuls points affichés).
+    """
+    xs, ys, idx = sample(x, y, bounds, width)
+    if callable(text):
+        kwargs["text"] = text(ys)
+    elif text is not None:
+        kwargs["text"] = np.asarray(text)[idx]
+    if len(xs) > SCATTERGL_THRESHOLD:
+        line = dict(kwargs.get("line") or {})
+        if line.get("shape") == "spline":  # non supporté en WebGL
+            line["shape"] = "linear"
+            kwargs["line"] = line
+        return go.Scattergl(x=xs, y=ys, **kwargs)
+    return go.Scatter(x=xs, y=ys, **kwargs)
+
+
+def bar_trace(x, y, bounds=None, width=CHART_WIDTH_PX, colors=None, **kwargs):
+    """Barres réduites par LTTB ; colors = (positif, négatif) appliqué en vectorisé sur les barres retenues."""
+    xs, ys, _ = sample(x, y, bounds, width)
+    if colors is not None:
+        kwargs["marker_color"] = np.where(ys >= 0, *colors)
+    return go.Bar(x=xs, y=ys, **kwargs)
+
+
+class FigureCache:
+    """Figures Plotly prêtes à afficher, mémorisées par clé (hash du résultat, page, graphique, options)."""
+
+    def __init__(self, max_items=64):
+        self.max_items = max_items
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            if key in self._figures:
+                self._figures.move_to_end(key)
+                return self._figures[key]
+        fig = build()  # hors verrou : deux sessions peuvent construire la même figure, la dernière gagne
+        with self._lock:
+            self._figures[key] = fig
+            self._figures.move_to_end(key)
+            while len(self._figures) > self.max_items:
+                self._figures.popitem(last=False)
+        return fig
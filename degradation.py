@@ -0,0 +1,143 @@
+# =============================================
+# IKSOU Pro – Vieillissement batterie
+# Comptage rainflow en flux (O(n), pile par série) sur le SOC normalisé
+# Vieillissement cyclique (profondeur de décharge, SOC moyen) + calendaire (durée, SOC)
+# Vectorisé sur les séries : bâtiments d'un parc ou scénarios d'un run_batch
+# =============================================
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+CYCLE_LIFE = 4000  # cycles complets (100 % DoD) avant fin de vie
+DOD_EXPONENT = 1.3  # Wöhler : cycles avant fin de vie à profondeur d = CYCLE_LIFE × d^-k
+SOC_STRESS = 1.04  # facteur exp(k × (SOC - 0.5)) : stocker ou cycler haut use davantage
+CALENDAR_FADE_PER_YEAR = 0.015  # perte de capacité par an à SOC 50 %
+END_OF_LIFE_FADE = 0.20  # fin de vie = 20 % de capacité perdue
+BATTERY_COST_PER_KWH = 300.0  # coût de remplacement (sans devise, comme les autres coûts du modèle)
+
+
+class DegradationMeter:
+    """Vieillissement de S batteries alimenté bloc par bloc (même résultat quel que soit le découpage).
+
+    Les points de retournement sont repérés en bloc (changements de signe de np.diff le long du temps) ;
+    seule la pile rainflow, qui ne garde que les extrema non encore appariés, parcourt ces extrema série par série.
+    """
+
+    def __init__(self, capacity, hours_per_step=1.0):
+        self.capacity = np.atleast_1d(np.asarray(capacity, dtype=float))
+        self.hours_per_step = hours_per_step
+        n = len(self.capacity)
+        self._stacks = [[] for _ in range(n)]
+        self._last = None  # dernier point, extremum candidat pas encore confirmé
+        self._direction = np.zeros(n)
+        self.damage = np.zeros(n)  # fraction de la durée de vie cyclique consommée
+        self.full_cycles = np.zeros(n)  # cycles équivalents complets (Σ profondeur)
+        self._calendar_stress = np.zeros(n)
+        self.steps = 0
+
+    def update(self, soc):
+        """soc : (S × T) en kWh (ou (T,) pour une seule série)."""
+        soc = np.asarray(soc, dtype=float).reshape(len(self.capacity), -1)
+        frac = np.divide(soc, self.capacity[:, None], out=np.zeros_like(soc), where=self.capacity[:, None] > 0)
+        if not frac.shape[1]:
+            return self
+        self._calendar_stress += np.exp(SOC_STRESS * (frac - 0.5)).sum(axis=1)
+        self.steps += frac.shape[1]
+        if self._last is None:
+            self._last = frac[:, 0].copy()
+            self._push(np.arange(len(frac)), self._last)  # point de départ
+        x = np.concatenate([self._last[:, None], frac], axis=1)
+        step = np.sign(np.diff(x, axis=1))
+        # Direction courante avant chaque pas : dernier signe non nul (report de self._direction entre blocs)
+        signs = np.concatenate([self._direction[:, None], step], axis=1)
+        last_move = np.where(signs != 0, np.arange(signs.shape[1]), 0)
+        np.maximum.accumulate(last_move, axis=1, out=last_move)
+        heading = np.take_along_axis(signs, last_move, axis=1)
+        turn = (step != 0) & (heading[:, :-1] != 0) & (step != heading[:, :-1])
+        rows, times = np.nonzero(turn)  # triés par série puis par temps
+        self._push(rows, x[rows, times])  # le point avant un changement de sens est un extremum
+        self._last, self._direction = x[:, -1].copy(), heading[:, -1].copy()
+        return self
+
+    def _push(self, rows, values):
+        """Empile les extrema (rows triées, ordre chronologique par série) et compte les cycles fermés."""
+        closed_rows, depth, mean, weight = [], [], [], []
+        bounds = np.searchsorted(rows, np.arange(len(self._stacks) + 1))
+        values = values.tolist()
+        for i in np.flatnonzero(np.diff(bounds)).tolist():
+            stack = self._stacks[i]
+            for value in values[bounds[i]:bounds[i + 1]]:
+                stack.append(value)
+                # Règle des 4 points (ASTM E1049) : tant que la dernière étendue couvre la précédente, celle-ci est un cycle
+                while len(stack) >= 3 and abs(stack[-1] - stack[-2]) >= abs(stack[-2] - stack[-3]):
+                    s2, s3 = stack[-2], stack[-3]
+                    closed_rows.append(i)
+                    depth.append(abs(s2 - s3))
+                    mean.append((s2 + s3) / 2)
+                    half = len(stack) == 3  # l'étendue contient le point de départ : demi-cycle
+                    weight.append(0.5 if half else 1.0)
+                    del stack[-3:-2 if half else -1]  # demi-cycle : le départ seul ; cycle : ses deux extrema
+        if closed_rows:
+            self._count(np.array(closed_rows), np.array(depth), np.array(mean), np.array(weight))
+
+    def _count(self, rows, depth, mean, weight):
+        np.add.at(self.damage, rows, weight * depth**DOD_EXPONENT / CYCLE_LIFE * np.exp(SOC_STRESS * (mean - 0.5)))
+        np.add.at(self.full_cycles, rows, weight * depth)
+
+    def _closed(self):
+        # Copie où le dernier point est poussé comme extremum final : l'état courant reste intact (flux continu)
+        meter = copy.copy(self)
+        meter._stacks = [list(stack) for stack in self._stacks]
+        meter.damage, meter.full_cycles = self.damage.copy(), self.full_cycles.copy()
+        rows = np.array([i for i, stack in enumerate(self._stacks) if self._last[i] != stack[-1]], dtype=np.intp)
+        meter._push(rows, self._last[rows])
+        return meter
+
+    def _residual(self):
+        # Extrema restés dans la pile : demi-cycles entre extrema consécutifs
+        damage, cycles = np.zeros(len(self._stacks)), np.zeros(len(self._stacks))
+        for i, stack in enumerate(self._stacks):
+            stack = np.asarray(stack)
+            ranges, means = np.abs(np.diff(stack)), (stack[1:] + stack[:-1]) / 2
+            damage[i] = (0.5 * ranges**DOD_EXPONENT / CYCLE_LIFE * np.exp(SOC_STRESS * (means - 0.5))).sum()
+            cycles[i] = (0.5 * ranges).sum()
+        return damage, cycles
+
+    def result(self, cost_per_kwh=BATTERY_COST_PER_KWH):
+        """Une ligne par série : cycles équivalents, pertes cyclique / calendaire / totale, capacité restante, coût."""
+        damage, cycles = self.damage.copy(), self.full_cycles.copy()
+        if self._last is not None:
+            closed = self._closed()
+            residual_damage, residual_cycles = closed._residual()
+            damage, cycles = closed.damage + residual_damage, closed.full_cycles + residual_cycles
+        years = self.steps * self.hours_per_step / 8760
+        mean_stress = self._calendar_stress / max(self.steps, 1)
+        cycle_fade = END_OF_LIFE_FADE * damage
+        calendar_fade = CALENDAR_FADE_PER_YEAR * years * mean_stress
+        fade = np.minimum(cycle_fade + calendar_fade, 1.0)
+        return pd.DataFrame({
+            "equivalent_full_cycles": cycles,
+            "cycle_fade_pct": cycle_fade * 100,
+            "calendar_fade_pct": calendar_fade * 100,
+            "capacity_fade_pct": fade * 100,
+            "remaining_capacity_kwh": self.capacity * (1 - fade),
+            # Part de la durée de vie consommée × prix de remplacement
+            "degradation_cost": fade / END_OF_LIFE_FADE * self.capacity * cost_per_kwh,
+        })
+
+
+def battery_aging(soc, capacity, hours_per_step=1.0, cost_per_kwh=BATTERY_COST_PER_KWH):
+    """Vieillissement de séries SOC complètes (S × T) en une passe."""
+    return DegradationMeter(capacity, hours_per_step).update(soc).result(cost_per_kwh)
+
+
+def site_aging(aging, capacity):
+    """Parc → site (une ligne) : pertes et cycles pondérés par la capacité, capacités et coûts additionnés."""
+    capacity = np.asarray(capacity, dtype=float)
+    total = capacity.sum()
+    weights = capacity / total if total > 0 else np.full(len(capacity), 1 / max(len(capacity), 1))
+    row = {k: float(aging[k].to_numpy() @ weights) for k in ("equivalent_full_cycles", "cycle_fade_pct", "calendar_fade_pct", "capacity_fade_pct")}
+    row.update({k: float(aging[k].sum()) for k in ("remaining_capacity_kwh", "degradation_cost")})
+    return pd.DataFrame([row])
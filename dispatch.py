@@ -0,0 +1,216 @@
+# =============================================
+# IKSOU Pro – Pilotage de la batterie
+# Tarif réseau (heures creuses / pleines / pointe), bilan réseau réalisé
+# MPC : programme linéaire sur une fenêtre glissante, résolu chaque heure (HiGHS : highspy si installé, sinon scipy)
+# =============================================
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linprog
+
+try:
+    import highspy
+except ImportError:  # optionnel : scipy.optimize.linprog, même solveur mais reconstruit à chaque heure
+    highspy = None
+
+EFFICIENCY = 0.95  # rendement de charge et de décharge (même valeur que le simulateur)
+GRID_PRICE = 0.20  # prix d'achat réseau de base (par kWh)
+FEED_IN_PRICE = 0.06  # prix de revente du surplus au réseau (par kWh)
+PEAK_HOURS, PEAK_FACTOR = (18, 22), 1.5  # pointe du soir
+OFF_PEAK_HOURS, OFF_PEAK_FACTOR = (0, 6), 0.75  # heures creuses de nuit
+MPC_HORIZON = 24  # heures de la fenêtre glissante
+HAS_HIGHSPY = highspy is not None
+
+
+def tariff(config, t):
+    """(prix d'achat, prix de revente) par heure t : config grid_price / feed_in_price, sinon valeurs par défaut."""
+    hour = np.asarray(t) % 24
+    factor = np.where((hour >= PEAK_HOURS[0]) & (hour < PEAK_HOURS[1]), PEAK_FACTOR,
+                      np.where((hour >= OFF_PEAK_HOURS[0]) & (hour < OFF_PEAK_HOURS[1]), OFF_PEAK_FACTOR, 1.0))
+    buy = float(config.get("grid_price", GRID_PRICE)) * factor
+    return buy, np.full(hour.shape, float(config.get("feed_in_price", FEED_IN_PRICE)))
+
+
+def battery_flows(soc, soc0, efficiency=EFFICIENCY):
+    """Énergie réellement prise (> 0) ou rendue (< 0) côté bâtiment, déduite de la variation du SOC."""
+    soc = np.asarray(soc, dtype=float)
+    stored = np.diff(soc, axis=-1, prepend=np.broadcast_to(np.asarray(soc0, dtype=float)[..., None], soc.shape[:-1] + (1,)))
+    return np.where(stored > 0, stored / efficiency, stored * efficiency)
+
+
+def grid_cost(load, flow, buy, sell):
+    """Coût réseau : achats au prix d'achat − reventes au prix de revente (load = conso − PV)."""
+    grid = load + flow
+    return (np.maximum(grid, 0) * buy - np.maximum(-grid, 0) * sell).sum(axis=-1)
+
+
+class MPCDispatcher:
+    """Commande prédictive d'une batterie : à chaque heure, PL sur [t, t + horizon), seule la 1re heure est appliquée.
+
+    Variables par heure : charge c, décharge d, achat i, revente e, SOC s. Les matrices de contraintes ne dépendent
+    que de la longueur de fenêtre : construites une fois, seuls le second membre et les prix changent.
+    Avec highspy, un modèle HiGHS persistant par longueur de fenêtre : chaque heure ne modifie que coûts et second
+    membre, le simplexe repart de la base optimale de l'heure précédente (démarrage à chaud).
+    """
+
+    def __init__(self, capacity, power, horizon=MPC_HORIZON, efficiency=EFFICIENCY):
+        self.capacity, self.power = float(capacity), float(power)
+        self.horizon, self.efficiency = int(horizon), efficiency
+        self._models = {}
+        self._highs = {}
+        self.solves = 0
+
+    def _model(self, h):
+        # (A_eq, bornes) pour une fenêtre de h heures, mis en cache (la fin d'horizon raccourcit la fenêtre)
+        if h not in self._models:
+            eta, eye, zero = self.efficiency, sp.identity(h, format="csr"), sp.csr_matrix((h, h))
+            balance = sp.hstack([-eye, eye, eye, -eye, zero])  # -c + d + i - e = conso - PV
+            dynamics = sp.hstack([-eta * eye, eye / eta, zero, zero, eye - sp.eye(h, k=-1)])  # s_k - s_k-1 - ηc + d/η = 0
+            bounds = np.repeat([[0, self.power], [0, self.power], [0, np.inf], [0, np.inf], [0, self.capacity]], h, axis=0)
+            self._models[h] = (sp.vstack([balance, dynamics]).tocsc(), bounds)
+        return self._models[h]
+
+    def _persistent(self, h):
+        # Modèle HiGHS gardé entre les heures (base conservée), un par longueur de fenêtre
+        if h not in self._highs:
+            a_eq, bounds = self._model(h)
+            lp = highspy.HighsLp()
+            lp.num_col_, lp.num_row_ = 5 * h, 2 * h
+            lp.col_cost_, lp.col_lower_, lp.col_upper_ = np.zeros(5 * h), bounds[:, 0].astype(float), bounds[:, 1].astype(float)
+            lp.row_lower_, lp.row_upper_ = np.zeros(2 * h), np.zeros(2 * h)
+            lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+            lp.a_matrix_.start_, lp.a_matrix_.index_, lp.a_matrix_.value_ = a_eq.indptr, a_eq.indices, a_eq.data
+            model = highspy.Highs()
+            model.setOptionValue("output_flag", False)
+            model.setOptionValue("presolve", "off")
+            model.passModel(lp)
+            self._highs[h] = (model, np.arange(5 * h, dtype=np.int32), np.arange(2 * h, dtype=np.int32))
+        return self._highs[h]
+
+    def _solve(self, load, buy, sell, soc):
+        h = len(load)
+        cost = np.concatenate([np.zeros(2 * h), buy, -sell, np.zeros(h)])
+        b_eq = np.concatenate([load, [soc], np.zeros(h - 1)])
+        if HAS_HIGHSPY:
+            model, cols, rows = self._persistent(h)
+            model.changeColsCost(len(cols), cols, cost)
+            model.changeRowsBounds(len(rows), rows, b_eq, b_eq)
+            model.run()
+            if model.getModelStatus() != highspy.HighsModelStatus.kOptimal:
+                raise ValueError(f"MPC : programme linéaire non résolu ({model.modelStatusToString(model.getModelStatus())})")
+            solution = model.getSolution()
+            x, reduced = np.asarray(solution.col_value).reshape(5, h), solution.col_dual[-1]
+        else:
+            a_eq, bounds = self._model(h)
+            res = linprog(cost, A_eq=a_eq, b_eq=b_eq, bounds=bounds, method="highs", options={"presolve": False})
+            if res.status != 0:
+                raise ValueError(f"MPC : programme linéaire non résolu ({res.message})")
+            x, reduced = res.x.reshape(5, h), res.lower.marginals[-1]
+        self.solves += 1
+        # Coût réduit du SOC final : valeur d'un kWh supplémentaire laissé en fin de fenêtre
+        return x[0], x[1], x[4], reduced
+
+    def run(self, load, buy, sell, soc0, forecast=None):
+        """Pilote toute la série load (conso − PV, par heure) ; forecast(t, h) → prévision de load sur [t, t + h).
+
+        Sans prévision : information parfaite. Renvoie {charge, discharge, soc, flow} sur l'horizon simulé.
+        """
+        load = np.asarray(load, dtype=float)
+        steps = len(load)
+        forecast = forecast or (lambda t, h: load[t:t + h])
+        out = {k: np.empty(steps) for k in ("charge", "discharge", "soc")}
+        soc, plan = float(soc0), None
+        for t in range(steps):
+            h = min(self.horizon, steps - t)
+            seen = forecast(t, h)
+            plan = self._shift(plan, t, h, seen, buy, sell)
+            if plan is None:
+                c, d, s, reduced = self._solve(seen, buy[t:t + h], sell[t:t + h], soc)
+                plan = {"start": t, "load": seen, "charge": c, "discharge": d, "soc": s, "reduced": reduced}
+            k = t - plan["start"]
+            out["charge"][t], out["discharge"][t] = plan["charge"][k], plan["discharge"][k]
+            soc = out["soc"][t] = min(max(plan["soc"][k], 0.0), self.capacity)
+        out["flow"] = out["charge"] - out["discharge"]
+        return out
+
+    def _shift(self, plan, t, h, seen, buy, sell):
+        """Réutilisation du plan : le plan précédent, prolongé d'une heure, reste optimal ? (certificat dual, sinon None).
+
+        Le plan précédent vidait la batterie en fin de fenêtre avec un coût réduit r ≥ 0 sur ce SOC nul. Prolonger
+        d'une heure sans utiliser la batterie reste optimal si η × y ≤ r, où y est le prix qui valorise cette heure
+        (achat si déficit, revente sinon). Ce test évite la résolution chaque fois que la fenêtre suivante ne
+        peut rien changer ; la part d'heures évitées dépend du profil de charge.
+        """
+        if plan is None or h != self.horizon or t - plan["start"] + h != len(plan["load"]) + 1:
+            return None
+        k = t - plan["start"]
+        if plan["soc"][-1] > 1e-9 * max(self.capacity, 1.0) or not np.array_equal(seen[:-1], plan["load"][k:]):
+            return None
+        new = t + h - 1
+        eta, reduced = self.efficiency, plan["reduced"]
+        # Décharger dans la nouvelle heure rapporte η × (achat évité ou revente) ; y charger coûte (achat ou revente perdue) / η
+        gain = buy[new] if seen[-1] > 0 else sell[new]
+        charge = buy[new] if seen[-1] >= 0 else sell[new]
+        if eta * gain > reduced + 1e-12:
+            return None
+        return {
+            "start": plan["start"],
+            "load": np.append(plan["load"], seen[-1]),
+            "charge": np.append(plan["charge"], 0.0),
+            "discharge": np.append(plan["discharge"], 0.0),
+            "soc": np.append(plan["soc"], 0.0),
+            "reduced": min(reduced, charge / eta),
+        }
+
+
+DP_LEVELS = 1000  # niveaux de la grille de SOC du programme dynamique
+
+
+def optimal_dispatch(load, buy, sell, capacity, power, soc0, levels=DP_LEVELS, efficiency=EFFICIENCY):
+    """Optimum hors ligne (information parfaite) par programmation dynamique sur une grille de SOC.
+
+    V_t(i) = min_k c_t(k) + V_t+1(i + k), k = pas de SOC atteignables en une heure. Le coût d'une heure est
+    convexe en k dès que prix d'achat ≥ prix de revente : V_t est alors la min-convolution de deux suites
+    convexes, obtenue en fusionnant leurs pentes (O(K) par heure). Sinon (ou si V_t+1 n'est plus convexe),
+    minimum direct sur la bande (K × pas).
+    Renvoie {cost, soc, flow} ; soc0 est arrondi au niveau le plus proche. Mémoire : (T + 1) × K valeurs.
+    """
+    load = np.asarray(load, dtype=float)
+    steps = len(load)
+    if capacity <= 0 or power <= 0 or levels < 2:
+        flow = np.zeros(steps)
+        return {"cost": float(grid_cost(load, flow, buy, sell)), "soc": np.full(steps, max(float(soc0), 0.0)), "flow": flow}
+    unit = capacity / (levels - 1)
+    up = min(int(efficiency * power / unit + 1e-9), levels - 1)  # pas de charge max (ηP stockés)
+    down = min(int(power / (efficiency * unit) + 1e-9), levels - 1)  # pas de décharge max (P/η déstockés)
+    k = np.arange(-down, up + 1)
+    flows = np.where(k > 0, k * unit / efficiency, k * unit * efficiency)  # côté bâtiment, par pas de SOC
+
+    value = np.empty((steps + 1, levels))
+    value[steps] = 0.0  # SOC final libre
+    for t in range(steps - 1, -1, -1):
+        grid = load[t] + flows
+        cost = np.where(grid > 0, buy[t] * grid, sell[t] * grid)  # c_t(k), k = -down … up
+        slopes = np.diff(cost[::-1])  # pentes de g(j) = c_t(-j), j = -up … down
+        future = np.diff(value[t + 1])
+        if np.all(np.diff(slopes) >= -1e-12) and np.all(np.diff(future) >= -1e-9):
+            merged = np.sort(np.concatenate([slopes, future]), kind="stable")
+            h = cost[-1] + value[t + 1, 0] + np.concatenate([[0.0], np.cumsum(merged)])
+            value[t] = h[up:up + levels]
+        else:
+            # Bande complète : (K × pas) candidats, états hors grille exclus par +inf
+            padded = np.concatenate([np.full(down, np.inf), value[t + 1], np.full(up, np.inf)])
+            value[t] = (np.lib.stride_tricks.sliding_window_view(padded, len(k)) + cost).min(axis=1)
+
+    # Passe avant : décision optimale depuis le SOC atteint, sur la bande d'états voisins
+    soc_index = np.empty(steps, dtype=np.intp)
+    i = int(round(min(max(float(soc0), 0.0), capacity) / unit))
+    for t in range(steps):
+        lo, hi = max(i - down, 0), min(i + up, levels - 1)
+        m = np.arange(lo, hi + 1)
+        grid = load[t] + flows[m - i + down]
+        i = lo + int(np.argmin(np.where(grid > 0, buy[t] * grid, sell[t] * grid) + value[t + 1, lo:hi + 1]))
+        soc_index[t] = i
+    soc = soc_index * unit
+    flow = battery_flows(soc, round(min(max(float(soc0), 0.0), capacity) / unit) * unit, efficiency)
+    return {"cost": float(grid_cost(load, flow, buy, sell)), "soc": soc, "flow": flow}
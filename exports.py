@@ -0,0 +1,85 @@
+# =============================================
+# IKSOU Pro – Exports des résultats (CSV, Excel, Parquet, Arrow IPC)
+# Générés à la demande (clic sur le bouton de téléchargement), jamais au rendu de la page
+# Mis en cache par (hash du résultat, format), borné en octets
+# =============================================
+
+import importlib.util
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pandas as pd
+
+CSV_CHUNK_ROWS = 50_000  # lignes sérialisées par bloc : jamais tout le CSV en une seule chaîne
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+HAS_OPENPYXL = importlib.util.find_spec("openpyxl") is not None
+
+
+def iter_csv(df, chunk_rows=CSV_CHUNK_ROWS):
+    """Blocs CSV encodés en UTF-8 (en-tête dans le premier bloc seulement)."""
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0).encode("utf-8")
+
+
+def write_csv(df, f, chunk_rows=CSV_CHUNK_ROWS):
+    for chunk in iter_csv(df, chunk_rows):
+        f.write(chunk)
+
+
+def write_excel(df, f):
+    with pd.ExcelWriter(f, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="Simulation IKSOU")
+
+
+def write_parquet(df, f):
+    df.to_parquet(f, index=False)
+
+
+def write_arrow(df, f):
+    # Feather v2 = format fichier Arrow IPC : relu sans copie par pyarrow / polars / DuckDB
+    df.reset_index(drop=True).to_feather(f)
+
+
+# format → (libellé, extension, type MIME, écrivain, dépendance disponible)
+EXPORT_FORMATS = {
+    "csv": ("CSV", "csv", "text/csv", write_csv, True),
+    "xlsx": ("Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", write_excel, HAS_OPENPYXL),
+    "parquet": ("Parquet", "parquet", "application/vnd.apache.parquet", write_parquet, HAS_PYARROW),
+    "arrow": ("Arrow IPC", "arrow", "application/vnd.apache.arrow.file", write_arrow, HAS_PYARROW),
+}
+
+
+def available_formats():
+    return [fmt for fmt, spec in EXPORT_FORMATS.items() if spec[4]]
+
+
+def export_bytes(df, fmt):
+    """Contenu complet du fichier d'export df au format fmt."""
+    buffer = BytesIO()
+    EXPORT_FORMATS[fmt][3](df, buffer)
+    return buffer.getvalue()
+
+
+class ExportCache:
+    """Exports déjà générés, clé = (hash du résultat, format) ; éviction LRU au-delà de max_bytes."""
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self._payloads = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            if key in self._payloads:
+                self._payloads.move_to_end(key)
+                return self._payloads[key]
+        payload = build()  # hors verrou : une génération lente ne bloque pas les autres sessions
+        with self._lock:
+            if key not in self._payloads:
+                self._payloads[key] = payload
+                self._size += len(payload)
+            while self._size > self.max_bytes and len(self._payloads) > 1:
+                self._size -= len(self._payloads.popitem(last=False)[1])
+        return payload
@@ -0,0 +1,229 @@
+# =============================================
+# IKSOU Pro – Prévision de consommation (scikit-learn)
+# Variables : calendrier (heure, jour), météo du run (température, ensoleillement), retards de consommation
+# Apprentissage incrémental (partial_fit) sur les runs archivés, modèle persisté sur disque
+# Quantiles P10 / P50 / P90 : gradient boosting (perte quantile) sur un réservoir borné d'exemples
+# =============================================
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.linear_model import SGDRegressor
+from sklearn.preprocessing import StandardScaler
+
+# Version du modèle persisté : un fichier d'une autre version est ignoré (réappris depuis l'archive)
+MODEL_VERSION = 3  # 3 : niveau appris sur les runs pour le premier jour prévu (il lisait le deuxième jour)
+HORIZON = 24  # heures prévues à partir de la dernière heure connue
+LAGS = (24, 48)  # retards utilisables pour tout l'horizon (≥ HORIZON)
+HISTORY = max(LAGS)  # heures de consommation nécessaires avant la première heure prévue
+TEMP_KNOTS = tuple(range(0, 36, 3))  # °C : charnières max(0, T - k), la réponse CVC sature loin de la consigne
+FEATURES = (("hour_sin", "hour_cos", "day_sin", "day_cos", "temp") + tuple(f"temp_{k}" for k in TEMP_KNOTS)
+            + ("solar",) + tuple(f"lag_{lag}" for lag in LAGS))
+MIN_UPDATES = 5000  # exemples vus par run au minimum (passes répétées sur les runs courts)
+QUANTILES = (0.1, 0.5, 0.9)
+RESERVOIR_ROWS = 50_000  # exemples gardés pour les modèles quantiles (échantillon uniforme de tous les runs)
+
+
+def weather_at(weather, t):
+    """Température extérieure et ensoleillement aux heures t (même indexation périodique que le simulateur)."""
+    temp, solar = np.asarray(weather["temp"], dtype=float), np.asarray(weather["solar"], dtype=float)
+    return temp[t % len(temp)], solar[t % len(solar)]
+
+
+def features(time, cons, weather):
+    """(X, niveau) des heures time[HISTORY:] : retards rapportés au niveau moyen des 24 h [t - 48, t - 24).
+
+    La cible y / niveau - 1 rend le modèle indépendant de la taille du site (nombre de bâtiments) ;
+    un modèle vierge (sortie 0) prévoit le niveau de la veille. Consommation inconnue (NaN) : retards NaN
+    (gérés par le gradient boosting), niveau sur les heures connues de la fenêtre, NaN si aucune.
+    """
+    time, cons = np.asarray(time), np.asarray(cons, dtype=float)
+    t = time[HISTORY:]
+    known = np.isfinite(cons)
+    window = np.concatenate([[0.0], np.cumsum(np.where(known, cons, 0.0))])
+    count = np.concatenate([[0], np.cumsum(known)])
+    idx = np.arange(HISTORY, len(cons))
+    seen = count[idx - 24] - count[idx - 48]
+    level = np.divide(window[idx - 24] - window[idx - 48], seen, out=np.full(len(idx), np.nan), where=seen > 0)
+    level = np.where(np.isnan(level) | (np.abs(level) > 1e-9), level, 1.0)
+    temp, solar = weather_at(weather, t)
+    hour, day = t % 24, (t // 24) % 7
+    x = np.column_stack([
+        np.sin(2 * np.pi * hour / 24), np.cos(2 * np.pi * hour / 24),
+        np.sin(2 * np.pi * day / 7), np.cos(2 * np.pi * day / 7),
+        temp, *(np.maximum(temp - k, 0) for k in TEMP_KNOTS), solar / 1000,
+        *(cons[idx - lag] / level for lag in LAGS),
+    ])
+    return x, level
+
+
+def extend_history(time, cons, length=HISTORY):
+    """Historique d'au moins length heures : un run plus court est complété en répétant sa première journée."""
+    time, cons = np.asarray(time), np.asarray(cons, dtype=float)
+    missing = length - len(cons)
+    if missing <= 0:
+        return time, cons
+    day = cons[:24]
+    pad = np.resize(day, ((missing + len(day) - 1) // len(day)) * len(day))[-missing:]
+    return np.concatenate([np.arange(time[0] - missing, time[0]).astype(time.dtype), time]), np.concatenate([pad, cons])
+
+
+class ConsumptionForecaster:
+    """Régression linéaire SGD sur variables standardisées, entraînée run par run (une seule fois par clé)."""
+
+    def __init__(self):
+        self.scaler = StandardScaler()
+        self.model = SGDRegressor(loss="huber", alpha=1e-4, learning_rate="adaptive", eta0=0.01, random_state=0)
+        self.version = MODEL_VERSION
+        self.runs = set()  # clés des runs déjà appris
+        self.samples = 0
+        self.abs_error = self.abs_actual = 0.0  # erreur mesurée : chaque run est prévu avant d'être appris
+        self.cons_sum, self.cons_hours = 0.0, 0  # niveau moyen des runs appris : a priori du premier jour prévu
+        self._x, self._y = np.empty((0, len(FEATURES))), np.empty(0)  # réservoir (algorithme R)
+        self._quantile_models = None  # réentraînés à la demande quand le réservoir a changé
+        self._lock = threading.Lock()
+
+    @property
+    def fitted(self):
+        return self.samples > 0
+
+    def partial_fit(self, key, time, cons, weather):
+        """Apprend un run (série complète) ; renvoie False s'il est déjà appris ou trop court."""
+        if key in self.runs or len(cons) <= HISTORY:
+            return False
+        x, level = features(time, cons, weather)
+        y = np.asarray(cons, dtype=float)[HISTORY:] / level - 1
+        order = np.random.default_rng(len(self.runs)).permutation(len(y))  # SGD : exemples mélangés
+        with self._lock:
+            if self.samples:
+                # Évaluation avant apprentissage (jamais vu) : erreur absolue du modèle ponctuel, en kWh
+                predicted = np.maximum((self.model.predict(self.scaler.transform(x)) + 1) * level, 0.0)
+                actual = np.asarray(cons, dtype=float)[HISTORY:]
+                self.abs_error += float(np.abs(predicted - actual).sum())
+                self.abs_actual += float(np.abs(actual).sum())
+            self.scaler.partial_fit(x)
+            xs = self.scaler.transform(x)
+            for _ in range(-(-MIN_UPDATES // len(y))):
+                self.model.partial_fit(xs[order], y[order])
+            self._sample(x, y)
+            self.runs.add(key)
+            self.samples += len(y)
+            self.cons_sum += float(np.sum(cons))
+            self.cons_hours += len(cons)
+        return True
+
+    def _sample(self, x, y):
+        # Réservoir : le j-ième exemple vu remplace une case au hasard avec probabilité RESERVOIR_ROWS / (j + 1)
+        free = max(RESERVOIR_ROWS - len(self._y), 0)
+        self._x, self._y = np.concatenate([self._x, x[:free]]), np.concatenate([self._y, y[:free]])
+        seen = self.samples + free + np.arange(len(y) - free)
+        slot = np.random.default_rng(self.samples).integers(0, seen + 1)
+        kept = slot < RESERVOIR_ROWS
+        self._x[slot[kept]], self._y[slot[kept]] = x[free:][kept], y[free:][kept]  # doublons : le dernier gagne
+        self._quantile_models = None
+
+    def _quantiles(self):
+        # Appelé sous verrou : un modèle de gradient boosting par quantile, sur le réservoir
+        if self._quantile_models is None:
+            self._quantile_models = [
+                HistGradientBoostingRegressor(loss="quantile", quantile=q, max_iter=150, random_state=0).fit(self._x, self._y)
+                for q in QUANTILES
+            ]
+        return self._quantile_models
+
+    def future(self, time, cons, weather, horizon=HORIZON):
+        """(heures, X, niveau) des horizon heures qui suivent la dernière heure connue, en un seul bloc."""
+        time, cons = extend_history(time, cons)
+        t = time[-1] + 1 + np.arange(horizon)
+        # Retards ≥ horizon : toutes les valeurs nécessaires sont connues ; cible fictive pour réutiliser features()
+        x, level = features(np.concatenate([time, t]), np.concatenate([cons, np.zeros(horizon)]), weather)
+        return t, x[-horizon:], level[-horizon:]
+
+    def predict(self, time, cons, weather, horizon=HORIZON):
+        """Consommation prévue sur les horizon heures suivantes (un appel de prédiction pour tout l'horizon)."""
+        t, x, level = self.future(time, cons, weather, horizon)
+        with self._lock:
+            ratio = self.model.predict(self.scaler.transform(x))
+        return t, np.maximum((ratio + 1) * level, 0.0)
+
+    def predict_quantiles(self, time, cons, weather, horizon=HORIZON):
+        """(heures, (horizon × len(QUANTILES))) : tout l'horizon prédit en un bloc par quantile, quantiles triés."""
+        t, x, level = self.future(time, cons, weather, horizon)
+        with self._lock:
+            ratio = np.column_stack([model.predict(x) for model in self._quantiles()])
+        return t, np.maximum((np.sort(ratio, axis=1) + 1) * level[:, None], 0.0)
+
+    def quantile_path(self, time, cons, weather, quantile=0.5):
+        """Prévision à J-1 de chaque heure de la série (T,), au quantile demandé : entrée du MPC ou d'une étude.
+
+        Les variables d'une heure t n'utilisent que la consommation avant t - 24 : la même valeur est prévue
+        quelle que soit l'origine dans les 24 h précédentes (fenêtres MPC successives cohérentes). Avant le
+        début de la série, consommation inconnue (retards NaN) ; sans heure connue dans la fenêtre du niveau,
+        moyenne des heures ≤ t - 24, et pour le premier jour niveau moyen des runs appris (rien de la série).
+        """
+        time, cons = np.asarray(time), np.asarray(cons, dtype=float)
+        n = len(cons)
+        before = np.arange(time[0] - HISTORY, time[0]).astype(time.dtype)
+        x, level = features(np.concatenate([before, time]), np.concatenate([np.full(HISTORY, np.nan), cons]), weather)
+        hours = np.arange(n)
+        past = np.cumsum(cons)[np.maximum(hours - 24, 0)] / (np.maximum(hours - 24, 0) + 1)  # moyenne des heures ≤ t - 24
+        prior = self.cons_sum / self.cons_hours if self.cons_hours else np.nan
+        level = np.where(np.isnan(level), np.where(hours >= 24, past, prior), level)
+        with self._lock:
+            model = self._quantiles()[QUANTILES.index(quantile)]
+            ratio = model.predict(x)
+        return np.maximum((ratio + 1) * level, 0.0)
+
+    def error(self):
+        """Erreur relative mesurée (WAPE, %) sur les runs prévus avant d'être appris ; None avant le 2e run."""
+        return 100 * self.abs_error / self.abs_actual if self.abs_actual > 0 else None
+
+    def digest(self):
+        """Empreinte de l'état appris (version, exemples, runs) : change à chaque apprentissage."""
+        with self._lock:
+            blob = json.dumps([MODEL_VERSION, self.samples, sorted(self.runs)])
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def sync(self, archive, weather_of):
+        """Apprend les runs archivés pas encore vus ; weather_of(meta) → météo du run (None : ignoré)."""
+        learned = 0
+        for key in archive.keys():
+            if key in self.runs:
+                continue
+            weather = weather_of(archive.meta(key))
+            if weather is None:
+                continue
+            df = archive.load(key, ["time", "cons"])
+            learned += self.partial_fit(key, df["time"].to_numpy(), df["cons"].to_numpy(), weather)
+        return learned
+
+    def save(self, path):
+        # Fichier complet ou rien (remplacement atomique), comme le cache disque des résultats
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock, open(tmp, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Modèle persisté, ou modèle vierge si le fichier est absent, illisible ou d'une autre version."""
+        try:
+            with open(path, "rb") as f:
+                model = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return cls()
+        return model if isinstance(model, cls) and getattr(model, "version", 1) == MODEL_VERSION else cls()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update({"abs_error": 0.0, "abs_actual": 0.0, **state})  # modèles persistés avant la mesure
+        self._lock = threading.Lock()
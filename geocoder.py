@@ -0,0 +1,201 @@
+# =============================================
+# IKSOU Pro – Géocodage hors ligne
+# Gazetteer local (index exact / préfixe / trigrammes) + cache disque des noms résolus
+# Nominatim n'est plus qu'un dernier recours, désactivé par défaut (IKSO_GEOCODER_ONLINE=1 pour l'activer)
+# =============================================
+
+import bisect
+import json
+import os
+import threading
+import time
+import unicodedata
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+import pandas as pd
+
+NOT_FOUND = (None, None, None, None, None)  # (lat, lon, pays, ville retenue, type de correspondance)
+MISS_TTL = 300  # secondes : un nom introuvable n'est pas recherché à nouveau avant ce délai
+
+
+def online_default():
+    """Nominatim autorisé seulement si IKSO_GEOCODER_ONLINE vaut 1 / true / yes (hôtes isolés : jamais d'attente réseau)."""
+    return os.environ.get("IKSO_GEOCODER_ONLINE", "").strip().lower() in ("1", "true", "yes")
+
+
+def normalize(name):
+    """Nom comparable : sans accents, minuscules, tirets/apostrophes → espaces."""
+    text = unicodedata.normalize("NFKD", str(name))
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    for sep in "-'’_,.":
+        text = text.replace(sep, " ")
+    return " ".join(text.split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    """Villes (nom, pays, lat, lon, population) indexées par nom exact, préfixe et trigrammes."""
+
+    def __init__(self, places):
+        self.places = places.reset_index(drop=True)
+        self._exact = {}
+        names = []
+        for i, row in enumerate(self.places.itertuples(index=False)):
+            for alias in [row.name] + [a for a in str(row.alt_names or "").split("|") if a]:
+                key = normalize(alias)
+                names.append((key, i))
+                self._exact.setdefault(key, []).append(i)
+        names.sort()
+        self._sorted = [n for n, _ in names]
+        self._sorted_ids = [i for _, i in names]
+        self._trigrams = {}
+        self._gram_count = {}
+        for key in self._exact:
+            grams = trigrams(key)
+            self._gram_count[key] = len(grams)
+            for gram in grams:
+                self._trigrams.setdefault(gram, set()).add(key)
+        self._population = self.places["population"].fillna(0).to_numpy()
+
+    @classmethod
+    def from_csv(cls, path):
+        """CSV du dépôt : name, country_code, lat, lon, population, alt_names."""
+        places = pd.read_csv(path, keep_default_na=False, na_values={"population": [""]})
+        return cls(places)
+
+    @classmethod
+    def from_geonames(cls, path):
+        """Extrait GeoNames (citiesXXXX.txt, tabulé) pour une couverture mondiale hors ligne."""
+        columns = {1: "name", 3: "alt_names", 4: "lat", 5: "lon", 8: "country_code", 14: "population"}
+        places = pd.read_csv(path, sep="\t", header=None, usecols=list(columns), quoting=3,
+                             keep_default_na=False, dtype={3: str}).rename(columns=columns)
+        places["alt_names"] = places["alt_names"].str.replace(",", "|")
+        return cls(places)
+
+    def _best(self, ids):
+        i = max(ids, key=lambda j: self._population[j])
+        row = self.places.iloc[i]
+        return float(row["lat"]), float(row["lon"]), str(row["country_code"]).upper(), str(row["name"])
+
+    def exact(self, name):
+        ids = self._exact.get(normalize(name))
+        return self._best(ids) if ids else None
+
+    def prefix(self, name, min_length=3):
+        """Ville la plus peuplée dont un nom commence par name (saisie partielle : « Casa », « Marr »)."""
+        key = normalize(name)
+        if len(key) < min_length:
+            return None
+        lo = bisect.bisect_left(self._sorted, key)
+        hi = bisect.bisect_right(self._sorted, key + "\uffff")
+        return self._best(self._sorted_ids[lo:hi]) if hi > lo else None
+
+    def suggest(self, name, k=5, threshold=0.3):
+        """Noms proches par similarité de trigrammes (fautes de frappe), du plus au moins proche."""
+        key = normalize(name)
+        grams = trigrams(key)
+        common = Counter(candidate for gram in grams for candidate in self._trigrams.get(gram, ()))
+        scored = [(shared / (len(grams) + self._gram_count[candidate] - shared), candidate) for candidate, shared in common.items()]
+        scored = [item for item in sorted(scored, reverse=True) if item[0] >= threshold]
+        return [(candidate, score) for score, candidate in scored[:k]]
+
+    def display(self, key):
+        """Nom affichable de la ville la plus peuplée portant ce nom normalisé."""
+        return self.places.iloc[max(self._exact[key], key=lambda j: self._population[j])]["name"]
+
+    def fuzzy(self, name, threshold=0.5):
+        matches = self.suggest(name, k=1, threshold=threshold)
+        return self._best(self._exact[matches[0][0]]) if matches else None
+
+
+def nominatim(city, timeout=10):
+    """Recherche en ligne (OpenStreetMap) : (lat, lon, pays, nom) ou None."""
+    url = f"https://nominatim.openstreetmap.org/search?q={urllib.parse.quote(city)}&format=json&limit=1"
+    req = urllib.request.Request(url, headers={'User-Agent': 'IKSOU-Pro/19.4'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            data = json.loads(r.read().decode())
+    except (OSError, ValueError):
+        return None
+    if not data:
+        return None
+    name = data[0].get('name') or data[0].get('display_name', city).split(',')[0]
+    return float(data[0]['lat']), float(data[0]['lon']), data[0].get('country_code', '').upper(), name
+
+
+class Geocoder:
+    """Nom de ville → (lat, lon, pays, ville retenue, correspondance) : cache disque, gazetteer exact, préfixe,
+    trigrammes, puis Nominatim (optionnel). Correspondance "exact", "prefix", "fuzzy" ou "online" : hors "exact",
+    la ville retenue est à montrer à l'utilisateur (« Saint » → Saint-Étienne).
+
+    Seuls les noms exacts et les réponses en ligne sont persistés : une saisie partielle (« Saint ») ou
+    approchée est recalculée (hors ligne, instantané). Les échecs sont mémorisés MISS_TTL secondes.
+    """
+
+    def __init__(self, gazetteer, cache_path=".ikso_cache/geocode.json", online=None):
+        self.gazetteer = gazetteer
+        self.cache_path = cache_path
+        self.online = online_default() if online is None else online
+        self._misses = {}  # nom normalisé → instant de l'échec
+        self._lock = threading.Lock()
+        try:
+            with open(cache_path, encoding="utf-8") as f:
+                # Entrées d'un ancien format (sans ville retenue ni correspondance) : recalculées
+                self._cache = {k: tuple(v) for k, v in json.load(f).items() if len(v) == len(NOT_FOUND)}
+        except (OSError, ValueError):
+            self._cache = {}
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._cache, f, ensure_ascii=False)
+                os.replace(tmp, self.cache_path)
+            except OSError:
+                pass
+
+    def lookup(self, city):
+        if not city or not normalize(city):
+            return NOT_FOUND
+        key = normalize(city)
+        if key in self._cache:
+            return self._cache[key]
+        g = self.gazetteer
+        found = g.exact(city)
+        if found:
+            self._remember(key, (*found, "exact"))
+            return self._cache[key]
+        for kind, search in (("prefix", g.prefix), ("fuzzy", g.fuzzy)):
+            found = search(city)
+            if found:
+                return (*found, kind)
+        if time.monotonic() - self._misses.get(key, -MISS_TTL) < MISS_TTL:
+            return NOT_FOUND
+        found = self.online and nominatim(city)
+        if not found:
+            self._misses[key] = time.monotonic()
+            return NOT_FOUND
+        self._remember(key, (*found, "online"))
+        return self._cache[key]
+
+    def suggest(self, city, k=5):
+        names = (self.gazetteer.display(name) for name, _ in self.gazetteer.suggest(city, 2 * k))
+        return list(dict.fromkeys(names))[:k]  # un alias et le nom principal → une seule suggestion
+
+
+def default_gazetteer(directory=None):
+    """Gazetteer du dépôt, ou extrait GeoNames si IKSO_GEONAMES pointe vers un fichier citiesXXXX.txt."""
+    geonames = os.environ.get("IKSO_GEONAMES")
+    if geonames and os.path.exists(geonames):
+        return Gazetteer.from_geonames(geonames)
+    directory = directory or os.path.dirname(os.path.abspath(__file__))
+    return Gazetteer.from_csv(os.path.join(directory, "gazetteer.csv"))
@@ -0,0 +1,162 @@
+# =============================================
+# IKSOU Pro – Historique des simulations (SQLite)
+# Une insertion par run, index date / agent / hash de config
+# Mode WAL : plusieurs sessions Streamlit écrivent sans se bloquer
+# Agrégats KPI (somme, compte, min, max) tenus à jour à chaque insertion
+# =============================================
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    agent TEXT NOT NULL,
+    config_hash TEXT,
+    cost REAL,
+    pv REAL,
+    cons REAL,
+    comfort REAL,
+    co2_saved_kg REAL,
+    trading_savings REAL,
+    bill_reduction REAL
+);
+CREATE INDEX IF NOT EXISTS runs_date ON runs(date);
+CREATE INDEX IF NOT EXISTS runs_agent ON runs(agent);
+CREATE INDEX IF NOT EXISTS runs_config_hash ON runs(config_hash);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS aggregates (
+    metric TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    min REAL,
+    max REAL
+);
+"""
+
+# Colonnes affichées (même ordre que l'ancien historique JSON)
+HISTORY_COLUMNS = ("date", "agent", "cost", "pv", "comfort", "co2_saved_kg")
+# Colonne runs ← clé KPI du simulateur ; chaque métrique a sa ligne d'agrégats
+METRICS = {
+    "cost": "total_cost",
+    "pv": "total_pv_kwh",
+    "cons": "total_consumption_kwh",
+    "comfort": "avg_comfort",
+    "co2_saved_kg": "co2_saved_kg",
+    "trading_savings": "trading_savings",
+    "bill_reduction": "bill_reduction_pct",
+}
+_INSERT = f"INSERT INTO runs (date, agent, config_hash, {', '.join(METRICS)}) VALUES (?, ?, ?{', ?' * len(METRICS)})"
+# Mise à jour O(1) : une ligne par métrique, quel que soit le nombre de runs
+_UPSERT = """
+INSERT INTO aggregates (metric, count, total, min, max) VALUES (?, 1, ?, ?, ?)
+ON CONFLICT(metric) DO UPDATE SET
+    count = count + 1, total = total + excluded.total,
+    min = MIN(min, excluded.min), max = MAX(max, excluded.max)
+"""
+
+
+class HistoryStore:
+    """Historique append-only : une connexion par thread (sessions Streamlit), écritures sérialisées par SQLite."""
+
+    def __init__(self, path="ikso_history.db", legacy_json="ikso_simulation_history.json"):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            columns = {row[1] for row in db.execute("PRAGMA table_info(runs)")}
+            for column in METRICS:
+                if column not in columns:  # base créée par une version antérieure
+                    db.execute(f"ALTER TABLE runs ADD COLUMN {column} REAL")
+        if legacy_json and os.path.exists(legacy_json):
+            self._import_json(legacy_json)
+        if not self._connect().execute("SELECT 1 FROM meta WHERE key = 'aggregates'").fetchone():
+            self.rebuild_aggregates()
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _import_json(self, path):
+        # Migration unique de l'ancien fichier JSON (marqueur dans meta : un historique effacé ne revient pas)
+        if self._connect().execute("SELECT 1 FROM meta WHERE key = 'legacy_json'").fetchone():
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+        rows = [(e.get("date", ""), e.get("agent", ""), None, *(e.get(column) for column in METRICS)) for e in entries]
+        with self._connect() as db:
+            db.executemany(_INSERT, rows)
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('legacy_json', ?)", (path,))
+        self.rebuild_aggregates()
+
+    def rebuild_aggregates(self):
+        """Recalcul complet depuis runs (migration, réparation) ; le chemin normal est incrémental."""
+        selects = " UNION ALL ".join(
+            f"SELECT '{c}', COUNT({c}), COALESCE(SUM({c}), 0), MIN({c}), MAX({c}) FROM runs" for c in METRICS
+        )
+        with self._connect() as db:
+            db.execute("DELETE FROM aggregates")
+            db.execute(f"INSERT INTO aggregates (metric, count, total, min, max) {selects}")
+            db.execute("DELETE FROM aggregates WHERE count = 0")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('aggregates', 'incremental')")
+
+    def append(self, agent, kpis, config_hash=None, date=None):
+        """Enregistre un run et met à jour les agrégats dans la même transaction ; renvoie son identifiant."""
+        date = date or datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+        values = {column: kpis.get(key) for column, key in METRICS.items()}
+        values = {column: None if v is None else float(v) for column, v in values.items()}
+        with self._connect() as db:
+            cursor = db.execute(_INSERT, (date, agent, config_hash, *values.values()))
+            db.executemany(_UPSERT, [(column, v, v, v) for column, v in values.items() if v is not None])
+        return cursor.lastrowid
+
+    def count(self):
+        # Tous les runs ont un coût : compte lu dans les agrégats, sans parcourir la table
+        row = self._connect().execute("SELECT count FROM aggregates WHERE metric = 'cost'").fetchone()
+        return row[0] if row else 0
+
+    def aggregates(self):
+        """{métrique: {count, sum, mean, min, max}} lus tels quels (une ligne par métrique)."""
+        rows = self._connect().execute("SELECT metric, count, total, min, max FROM aggregates").fetchall()
+        return {
+            metric: {"count": count, "sum": total, "mean": total / count, "min": low, "max": high}
+            for metric, count, total, low, high in rows
+        }
+
+    def agents(self):
+        return [row[0] for row in self._connect().execute("SELECT DISTINCT agent FROM runs ORDER BY agent")]
+
+    def query(self, agent=None, config_hash=None, since=None, until=None, limit=None, columns=HISTORY_COLUMNS):
+        """Runs filtrés, du plus récent au plus ancien (filtres servis par les index)."""
+        where, params = [], []
+        for clause, value in (("agent = ?", agent), ("config_hash = ?", config_hash), ("date >= ?", since), ("date <= ?", until)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        sql = f"SELECT {', '.join(columns)} FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return pd.read_sql_query(sql, self._connect(), params=params)
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM runs")
+            db.execute("DELETE FROM aggregates")
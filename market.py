@@ -0,0 +1,108 @@
+# =============================================
+# IKSOU Pro – Marché P2P : enchère double à prix uniforme
+# Carnet d'ordres par bâtiment et par heure : surplus → offres de vente, déficit → offres d'achat
+# Compensation par tri, vectorisée sur toutes les heures d'un bloc (milliers de pairs)
+# =============================================
+
+import numpy as np
+import pandas as pd
+
+MARKET_SPREAD = 0.25  # limites par défaut : vente à prix × (1 - écart), achat à prix × (1 + écart)
+LIMIT_PRICES = ("ask_price", "bid_price")  # colonnes optionnelles du parc (config["fleet"])
+MIN_ORDER_KWH = 1e-4  # en dessous : bruit d'arrondi (résultats float32, sommes cumulées), pas un ordre
+
+
+def peer_limits(config):
+    """Prix limites (pair,) : colonnes ask_price / bid_price du parc, sinon autour de trading_price."""
+    n = len(config["buildings"])
+    fleet = config.get("fleet") or {}
+    price = float(config["trading_price"])
+    ask = fleet.get("ask_price", price * (1 - MARKET_SPREAD))
+    bid = fleet.get("bid_price", price * (1 + MARKET_SPREAD))
+    return (np.broadcast_to(np.asarray(ask, dtype=float), (n,)),
+            np.broadcast_to(np.asarray(bid, dtype=float), (n,)))
+
+
+def _rowwise_searchsorted(rows, queries, side):
+    # searchsorted ligne par ligne en un seul appel : chaque ligne décalée au-delà du maximum de la précédente
+    h, p = rows.shape
+    span = max(rows[:, -1].max(), queries.max()) + 1.0
+    offset = np.arange(h)[:, None] * span
+    flat = np.searchsorted((rows + offset).ravel(), (queries + offset).ravel(), side=side)
+    return flat.reshape(queries.shape) - np.arange(h)[:, None] * p
+
+
+def _clear_block(net, ask, bid):
+    # net, ask, bid : (heure × pair) ; renvoie volume, prix, vendu et acheté par pair
+    h, p = net.shape
+    supply, demand = np.where(net > MIN_ORDER_KWH, net, 0), np.where(net < -MIN_ORDER_KWH, -net, 0)
+    sellers = np.argsort(np.where(supply > 0, ask, np.inf), axis=1, kind="stable")  # prix croissants
+    buyers = np.argsort(np.where(demand > 0, -bid, np.inf), axis=1, kind="stable")  # prix décroissants
+    s, a = np.take_along_axis(supply, sellers, 1), np.take_along_axis(ask, sellers, 1)
+    d, b = np.take_along_axis(demand, buyers, 1), np.take_along_axis(bid, buyers, 1)
+    a = np.where(s > 0, a, np.inf)
+    b = np.where(d > 0, b, -np.inf)
+    s_cum, d_cum = np.cumsum(s, axis=1), np.cumsum(d, axis=1)
+    s_start, d_start = s_cum - s, d_cum - d
+
+    # Prix de la courbe opposée au premier kWh de chaque offre (inf / -inf : courbe épuisée)
+    bid_at = np.take_along_axis(np.pad(b, ((0, 0), (0, 1)), constant_values=-np.inf),
+                                _rowwise_searchsorted(d_cum, s_start, "right"), 1)
+    ask_at = np.take_along_axis(np.pad(a, ((0, 0), (0, 1)), constant_values=np.inf),
+                                _rowwise_searchsorted(s_cum, d_start, "right"), 1)
+    # Offres acceptées = préfixe de chaque courbe ; volume échangé = le plus court des deux préfixes
+    volume = np.minimum(np.where(a <= bid_at, s_cum, 0).max(axis=1), np.where(b >= ask_at, d_cum, 0).max(axis=1))
+    sold_sorted = np.clip(volume[:, None] - s_start, 0, s)
+    bought_sorted = np.clip(volume[:, None] - d_start, 0, d)
+
+    # Prix uniforme : milieu entre la dernière offre de vente et la dernière offre d'achat retenues
+    rows = np.arange(h)
+    last_ask = a[rows, np.maximum((sold_sorted > MIN_ORDER_KWH).sum(axis=1) - 1, 0)]
+    last_bid = b[rows, np.maximum((bought_sorted > MIN_ORDER_KWH).sum(axis=1) - 1, 0)]
+    with np.errstate(invalid="ignore"):  # heures sans échange : inf - inf, remplacé par NaN
+        price = np.where(volume > 0, (last_ask + last_bid) / 2, np.nan)
+
+    sold, bought = np.empty_like(net), np.empty_like(net)
+    np.put_along_axis(sold, sellers, sold_sorted, 1)
+    np.put_along_axis(bought, buyers, bought_sorted, 1)
+    return volume, price, sold, bought
+
+
+def clear_market(net, ask, bid, block_cells=1 << 22):
+    """Enchère double heure par heure.
+
+    net : (pair × heure) énergie résiduelle, > 0 à vendre, < 0 à acheter ; ask / bid : prix limites
+    (pair,) ou (pair × heure). Renvoie {volume, price} par heure (prix NaN sans échange) et
+    {sold, bought} par pair et par heure.
+    """
+    net = np.asarray(net, dtype=float)
+    p, h = net.shape
+    ask, bid = (np.asarray(x, dtype=float) for x in (ask, bid))
+    ask = np.broadcast_to(ask[:, None] if ask.ndim == 1 else ask, (p, h))
+    bid = np.broadcast_to(bid[:, None] if bid.ndim == 1 else bid, (p, h))
+    result = {"volume": np.empty(h), "price": np.empty(h), "sold": np.empty((p, h)), "bought": np.empty((p, h))}
+    hours = max(1, block_cells // max(p, 1))  # mémoire bornée : blocs d'heures, tous les pairs à la fois
+    for start in range(0, h, hours):
+        t = slice(start, min(start + hours, h))
+        volume, price, sold, bought = _clear_block(net[:, t].T, ask[:, t].T, bid[:, t].T)
+        result["volume"][t], result["price"][t] = volume, price
+        result["sold"][:, t], result["bought"][:, t] = sold.T, bought.T
+    return result
+
+
+def settlements(market, peers):
+    """Règlement par pair sur tout l'horizon : énergie vendue / achetée, recettes, dépenses, solde."""
+    price = np.nan_to_num(market["price"])
+    revenue = market["sold"] @ price
+    cost = market["bought"] @ price
+    sold, bought = market["sold"].sum(axis=1), market["bought"].sum(axis=1)
+    traded = sold + bought
+    return pd.DataFrame({
+        "building": list(peers),
+        "sold_kwh": sold,
+        "bought_kwh": bought,
+        "revenue": revenue,
+        "cost": cost,
+        "net_settlement": revenue - cost,
+        "avg_price": np.divide(revenue + cost, traded, out=np.full(len(traded), np.nan), where=traded > 0),
+    })
@@ -0,0 +1,121 @@
+# =============================================
+# IKSOU Pro – Cache des résultats de simulation
+# Clé = hash canonique (config + code contrôleur + graine + saison)
+# Deux niveaux : LRU en mémoire + disque avec éviction par taille
+# =============================================
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from simulator import MODEL_VERSION, code_hash, current_season
+from weather_store import open_store
+
+
+def _canonical(value):
+    # Types numpy / tuples → JSON stable (les clés sont triées au dump)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+
+def simulation_key(config, seed=None, engine="numpy", forecast=None):
+    """Hash de contenu d'une simulation : mêmes entrées → même clé, entre sessions et redémarrages.
+
+    forecast : empreinte du modèle de prévision qui pilote le MPC (résultats dépendant de son état).
+    """
+    params = {k: v for k, v in config.items() if k != "control_code"}
+    payload = {
+        "config": params,
+        "control": code_hash(config.get("control_code", "")),
+        "seed": seed,
+        "season": current_season(),
+        "engine": engine,
+        "model": MODEL_VERSION,
+    }
+    if config.get("weather_site"):
+        # Contenu du site importé : un ré-import des mêmes données change la clé
+        store = open_store(config.get("weather_store", "weather_store"))
+        site = store.resolve(config["weather_site"], config["lat"], config["lon"])
+        payload["weather"] = store.digest(site, config.get("weather_year"))
+    if forecast is not None:
+        payload["forecast"] = forecast
+    blob = json.dumps(payload, sort_keys=True, default=_canonical, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Cache (df, kpis) : LRU mémoire borné en entrées, puis fichiers pickle bornés en octets."""
+
+    def __init__(self, directory=".ikso_cache", max_items=32, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)  # l'accès compte pour l'éviction LRU disque
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)  # écriture atomique : pas de fichier partiel pour les autres sessions
+        except OSError:
+            return
+        self._evict_disk()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                try:
+                    info = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):  # les moins récemment utilisés d'abord
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,99 @@
+# =============================================
+# IKSOU Pro – Archive des séries temporelles par run
+# Un répertoire par clé de contenu (simulation_key) : data.parquet (zstd, groupes de lignes par semaine) + meta.json
+# Lecture paresseuse : projection de colonnes et groupes de lignes filtrés sur les statistiques min/max de time
+# =============================================
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ROW_GROUP_HOURS = 24 * 7  # un groupe de lignes par semaine simulée : une plage horaire ne décode que ses semaines
+
+
+class RunArchive:
+    """Archive colonnaire des runs, dédupliquée par clé : une même configuration n'est écrite qu'une fois."""
+
+    def __init__(self, directory=".ikso_archive"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        # Un répertoire sans data.parquet (ancien format .npy par colonne) n'est pas lu : réécrit au prochain put
+        return all(os.path.exists(os.path.join(self._path(key), name)) for name in ("meta.json", "data.parquet"))
+
+    def put(self, key, df, kpis=None, weather=None):
+        """Archive df (colonnes numériques) sous key ; renvoie False si le run était déjà archivé.
+
+        weather : source météo du run (cf. simulator.weather_source), pour réentraîner les modèles de prévision.
+        """
+        if key in self:
+            return False
+        tmp = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            pq.write_table(table, os.path.join(tmp, "data.parquet"), row_group_size=ROW_GROUP_HOURS, compression="zstd")
+            meta = {
+                "rows": len(df),
+                "columns": {column: str(df[column].dtype) for column in df.columns},
+                "kpis": {k: float(v) for k, v in (kpis or {}).items()},
+                "weather": weather,
+            }
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            if os.path.isdir(self._path(key)):
+                shutil.rmtree(self._path(key), ignore_errors=True)  # ancien format sous la même clé
+            os.replace(tmp, self._path(key))  # répertoire complet ou rien : pas de run partiel visible
+        except OSError:
+            # Un autre processus a archivé la même clé entre-temps (ou disque plein) : on garde l'existant
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+        return True
+
+    def meta(self, key):
+        with open(os.path.join(self._path(key), "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def keys(self):
+        return sorted(name for name in os.listdir(self.directory) if name in self)
+
+    def load(self, key, columns=None, start=None, stop=None):
+        """DataFrame des colonnes demandées sur les heures [start, stop) de la colonne time.
+
+        Seuls les groupes de lignes dont les statistiques de time recoupent la plage sont décodés ;
+        l'index reprend la position des lignes dans le run.
+        """
+        pf = pq.ParquetFile(os.path.join(self._path(key), "data.parquet"))
+        columns = list(pf.schema_arrow.names) if columns is None else list(columns)
+        t = pf.schema_arrow.get_field_index("time")
+        ranged = t >= 0 and (start is not None or stop is not None)
+        groups, positions, offset = [], [], 0
+        for i in range(pf.metadata.num_row_groups):
+            rg = pf.metadata.row_group(i)
+            stats = rg.column(t).statistics if ranged else None
+            if stats is None or not stats.has_min_max or (
+                    (start is None or stats.max >= start) and (stop is None or stats.min < stop)):
+                groups.append(i)
+                positions.append(np.arange(offset, offset + rg.num_rows))
+            offset += rg.num_rows
+        read = columns + ["time"] if ranged and "time" not in columns else columns
+        df = pf.read_row_groups(groups, columns=read).to_pandas()
+        df.index = np.concatenate(positions) if positions else np.arange(0)
+        if ranged:
+            time = df["time"].to_numpy()
+            keep = np.ones(len(df), dtype=bool)
+            if start is not None:
+                keep &= time >= start
+            if stop is not None:
+                keep &= time < stop
+            df = df[keep]
+        return df[columns]
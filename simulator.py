@@ -0,0 +1,713 @@
+# =============================================
+# IKSOU Pro – Moteur de simulation microgrid
+# Météo saisonnière, contrôleurs, moteurs numpy / fleet / batch
+# Sans dépendance Streamlit : importable par les workers d'optimisation
+# =============================================
+
+import datetime
+import hashlib
+import math
+from functools import lru_cache
+from types import MappingProxyType
+from itertools import accumulate
+
+import numpy as np
+import pandas as pd
+
+from degradation import DegradationMeter, battery_aging, site_aging
+from dispatch import DP_LEVELS, MPC_HORIZON, MPCDispatcher, battery_flows, grid_cost, optimal_dispatch, tariff
+from market import clear_market, peer_limits, settlements
+from weather_store import open_store
+
+# Nouveau: Facteur CO2 avec référence IEA (International Energy Agency)
+# Source: IEA - CO2 emissions factor for grid electricity avoidance via renewables ~400-500 gCO2/kWh, on utilise 450 g/kWh moyen
+CO2_FACTOR = 450  # g CO2 / kWh évité (référence: IEA Global Energy Review 2023)
+# Version du modèle : incrémentée quand une même configuration donne d'autres résultats (clé de cache)
+MODEL_VERSION = 8  # 8 : réduction de facture au tarif horaire (avant : part du PV dans la consommation)
+
+# =====================================
+# MÉTÉO SAISONNIÈRE (remplace 72h par estimations saisonnières)
+# =====================================
+def rng_streams(seed=None):
+    """Générateurs indépendants (météo, charge) issus d'une même graine : seed=None → tirage non reproductible."""
+    weather_seq, load_seq = np.random.SeedSequence(seed).spawn(2)
+    return np.random.default_rng(weather_seq), np.random.default_rng(load_seq)
+
+def fetch_seasonal_weather(lat, lon, season='winter', rng=None):  # Exemple simple, on peut étendre
+    rng = rng if rng is not None else np.random.default_rng()
+    seasons = {
+        'winter': {'temp_mean': 5, 'temp_amp': 5, 'solar_mean': 200},
+        'spring': {'temp_mean': 15, 'temp_amp': 10, 'solar_mean': 500},
+        'summer': {'temp_mean': 25, 'temp_amp': 10, 'solar_mean': 800},
+        'autumn': {'temp_mean': 15, 'temp_amp': 8, 'solar_mean': 400}
+    }
+    params = seasons.get(season, seasons['winter'])
+    
+    # Génération de données saisonnières sur 3 mois (simulé)
+    t = np.linspace(0, 2160, 2160)  # 90 jours * 24h
+    temp = params['temp_mean'] + params['temp_amp'] * np.sin(2*np.pi*t/24) + rng.normal(0, 2, len(t))
+    solar = np.maximum(0, params['solar_mean'] * np.sin(2*np.pi*(t-6)/24)) + rng.normal(0, 50, len(t))
+    
+    return {
+        "temp": temp,
+        "solar": solar
+    }
+
+def seasonal_weather(lat, lon, season=None, seed=None):
+    """Météo saisonnière partagée : un seul jeu de tableaux (lecture seule) par (lat, lon, saison, graine).
+
+    Simulateur, Météo et Prévisions lisent le même tirage ; seed=None → nouveau tirage à chaque appel.
+    """
+    season = season or current_season()
+    if seed is None:
+        return fetch_seasonal_weather(lat, lon, season)
+    return _cached_weather(float(lat), float(lon), season, int(seed))
+
+@lru_cache(maxsize=32)
+def _cached_weather(lat, lon, season, seed):
+    weather = fetch_seasonal_weather(lat, lon, season, rng=rng_streams(seed)[0])
+    for values in weather.values():
+        values.setflags(write=False)
+    return MappingProxyType(weather)
+
+def weather_source(config, seed=None):
+    """Ce qu'il faut pour retrouver la météo d'un run (archivé avec lui) ; None si le tirage n'est pas reproductible."""
+    seed = config.get("seed") if seed is None else seed
+    if config.get("weather_site"):
+        return {key: config.get(key) for key in ("weather_site", "weather_year", "weather_store", "lat", "lon")}
+    if seed is None:
+        return None
+    return {"lat": float(config["lat"]), "lon": float(config["lon"]), "season": current_season(), "seed": int(seed)}
+
+def source_weather(source):
+    """Météo {temp, solar} décrite par weather_source (None si source vide)."""
+    if not source:
+        return None
+    if source.get("weather_site"):
+        store = open_store(source.get("weather_store") or "weather_store")
+        site = store.resolve(source["weather_site"], source.get("lat"), source.get("lon"))
+        return store.load(site, source.get("weather_year"))
+    return seasonal_weather(source["lat"], source["lon"], source["season"], source["seed"])
+
+# =====================================
+# CONTRÔLEUR (compilé une seule fois par hash de code)
+# =====================================
+def default_control(state, t):
+    # Régulateur P historique (Kp = 0.5), valable en scalaire comme en tableaux
+    return np.clip((state["temp_target"] - state["outdoor_temp"]) * 0.5, -1, 1)
+
+class Controller:
+    """Contrôleur utilisateur : control(state, t) et/ou control_batch(states, t_array)."""
+    def __init__(self, control=None, control_batch=None):
+        self.control = control
+        self.control_batch = control_batch
+
+    def step(self, state, t):
+        if self.control is None:
+            states = {k: np.array([v], dtype=float) for k, v in state.items()}
+            return float(self.batch(states, np.array([t]))[0])
+        try:
+            return float(self.control(state, t))
+        except Exception as e:
+            raise ValueError(f"Erreur du contrôleur à t={t} : {e}") from e
+
+    def batch(self, states, t):
+        try:
+            if self.control_batch is not None:
+                action = np.asarray(self.control_batch(states, t), dtype=float)
+                return np.broadcast_to(action, t.shape)
+            keys = list(states)
+            rows = zip(*(np.broadcast_to(states[k], t.shape).ravel().tolist() for k in keys))
+            actions = (self.control(dict(zip(keys, row)), ti) for row, ti in zip(rows, t.ravel().tolist()))
+            return np.fromiter(actions, dtype=float, count=t.size).reshape(t.shape)
+        except Exception as e:
+            raise ValueError(f"Erreur du contrôleur : {e}") from e
+
+    def check(self):
+        # Appel d'essai sur un état type : le contrôleur doit renvoyer une action numérique finie
+        state = {"temp_target": 22.0, "current_temp": 22.0, "outdoor_temp": 10.0, "solar": 300.0}
+        action = self.step(state, 0)
+        actions = self.batch({k: np.full(3, v) for k, v in state.items()}, np.arange(3))
+        if not (math.isfinite(action) and np.all(np.isfinite(actions))):
+            raise ValueError("le contrôleur renvoie une action non finie")
+        if self.control_batch is None:
+            self.control_batch = self._vectorized_control()
+
+    def _vectorized_control(self):
+        # Beaucoup de control(state, t) acceptent directement des tableaux (np.clip...) :
+        # si l'appel vectorisé reproduit les appels scalaires sur une grille d'essai, on l'utilise en batch
+        states = {
+            "temp_target": np.repeat([18.0, 22.0, 26.0], 16),
+            "current_temp": np.repeat([18.0, 22.0, 26.0], 16),
+            "outdoor_temp": np.tile(np.linspace(-10, 40, 16), 3),
+            "solar": np.tile(np.linspace(0, 1000, 16), 3),
+        }
+        t = np.arange(48)
+        try:
+            with np.errstate(all="ignore"):
+                vectorized = np.broadcast_to(np.asarray(self.control(states, t), dtype=float), t.shape)
+        except Exception:
+            return None
+        if np.allclose(vectorized, self.batch(states, t), equal_nan=True):
+            return self.control
+        return None
+
+def code_hash(code):
+    return hashlib.sha256((code or "").encode("utf-8")).hexdigest()
+
+def compile_controller(code):
+    """Compile et valide control_code ; résultat mis en cache par hash du code."""
+    return _compile_controller(code_hash(code), code or "")
+
+@lru_cache(maxsize=128)
+def _compile_controller(key, code):
+    if not code.strip():
+        return Controller(control_batch=default_control)
+    namespace = {"np": np, "math": math}
+    try:
+        exec(compile(code, "<control_code>", "exec"), namespace)
+    except Exception as e:
+        raise ValueError(f"Code contrôleur invalide : {e}") from e
+    control, control_batch = namespace.get("control"), namespace.get("control_batch")
+    if not callable(control) and not callable(control_batch):
+        raise ValueError("Le code doit définir control(state, t) ou control_batch(states, t_array)")
+    controller = Controller(control if callable(control) else None, control_batch if callable(control_batch) else None)
+    try:
+        controller.check()
+    except Exception as e:
+        raise ValueError(f"Contrôleur invalide : {e}") from e
+    return controller
+
+# =====================================
+# SIMULATEUR COMPLET (ajout CO2 avec ref IEA + devise)
+# =====================================
+def current_season():
+    month = datetime.datetime.now().month
+    if month in [12,1,2]: return 'winter'
+    elif month in [3,4,5]: return 'spring'
+    elif month in [6,7,8]: return 'summer'
+    return 'autumn'
+
+def soc_kernel(delta, soc0, capacity):
+    """Récurrence SOC bornée : seule partie séquentielle du moteur vectorisé."""
+    clip = lambda s, d: min(max(s + d, 0.0), capacity)
+    return np.fromiter(accumulate(delta.tolist(), clip, initial=soc0), dtype=float, count=len(delta) + 1)[1:]
+
+def soc_kernel_fleet(delta, soc0, capacity):
+    """Récurrence SOC bornée pour un parc : boucle sur le temps, vectorisée sur les bâtiments."""
+    if delta.shape[0] == 1:
+        # Une seule série : la boucle scalaire évite T petits appels numpy (~5× plus rapide)
+        soc = soc_kernel(delta[0], float(np.asarray(soc0).ravel()[0]), float(np.asarray(capacity).ravel()[0]))
+        return soc.astype(delta.dtype, copy=False)[None]
+    soc = np.empty(delta.shape, dtype=delta.dtype, order="F")  # colonnes (un pas de temps) contiguës
+    s = soc0.astype(delta.dtype)
+    for t in range(delta.shape[1]):
+        s = np.minimum(np.maximum(s + delta[:, t], 0), capacity)
+        soc[:, t] = s
+    return soc
+
+# Paramètres pouvant différer d'un bâtiment à l'autre dans config["fleet"]
+FLEET_PARAMS = ("pv_area", "battery_capacity", "battery_power", "temp_target", "initial_soc")
+FLEET_COLUMNS = ("cons", "pv", "hvac", "temp", "comfort", "soc", "battery")
+
+def fleet_params(config):
+    """Tableaux (bâtiment,) des paramètres : config["fleet"] colonne par colonne, sinon valeur globale."""
+    n = len(config["buildings"])
+    fleet = config.get("fleet") or {}
+    return {k: np.broadcast_to(np.asarray(fleet.get(k, config[k]), dtype=float), (n,)) for k in FLEET_PARAMS}
+
+def p2p_market(config):
+    """Marché P2P actif : trading activé et au moins deux bâtiments pour se faire face."""
+    return bool(config.get("enable_trading")) and len(config["buildings"]) > 1
+
+def total_battery_capacity(config):
+    return float(fleet_params(config)["battery_capacity"].sum())
+
+def mpc_enabled(config):
+    """Pilotage de la batterie : "rule" (suivi du bilan, historique) ou "mpc" (fenêtre glissante optimisée)."""
+    return config.get("dispatch", "rule") == "mpc"
+
+def mpc_dispatch(config, cons, pv, capacity, power, soc0, forecast=None):
+    """Batterie d'une série pilotée par MPC au tarif horaire : (flux batterie, SOC, nombre de résolutions)."""
+    load = np.asarray(cons, dtype=float) - pv
+    buy, sell = tariff(config, np.arange(len(load)))
+    mpc = MPCDispatcher(capacity, power, config.get("mpc_horizon", MPC_HORIZON))
+    out = mpc.run(load, buy, sell, soc0, forecast)
+    return out["flow"], out["soc"], mpc.solves
+
+def series_grid_cost(config, load, soc, soc0):
+    """Coût réseau (S,) de séries (S × T) : bilan après flux batterie réels, au tarif horaire."""
+    buy, sell = tariff(config, np.arange(np.shape(load)[-1]))
+    return grid_cost(load, battery_flows(soc, soc0), buy, sell)
+
+def series_bill(config, cons):
+    """Facture réseau sans PV ni batterie (S,) : toute la consommation (S × T) achetée au tarif horaire."""
+    buy, _ = tariff(config, np.arange(np.shape(cons)[-1]))
+    return (np.asarray(cons, dtype=float) * buy).sum(axis=-1)
+
+def optimal_enabled(config):
+    """Référence optimale (programmation dynamique, une par batterie) : coûteuse, calculée sur demande seulement."""
+    return bool(config.get("optimal_baseline"))
+
+def series_optimal_cost(config, load, capacity, power, soc0):
+    """Coût réseau optimal (S,) de séries (S × T), batterie pilotée en information parfaite (cf. optimal_dispatch)."""
+    load = np.atleast_2d(np.asarray(load, dtype=float))
+    buy, sell = tariff(config, np.arange(load.shape[1]))
+    levels = config.get("dp_levels", DP_LEVELS)
+    return np.array([optimal_dispatch(row, buy, sell, c, p, s, levels)["cost"]
+                     for row, c, p, s in zip(load, *(np.broadcast_to(np.asarray(x, dtype=float), len(load)) for x in (capacity, power, soc0)))])
+
+# Colonnes de résultats (hors "time"), stockées dans un seul bloc pré-alloué
+RESULT_COLUMNS = ("cons", "pv", "hvac", "temp", "comfort", "soc", "battery", "trade", "price")
+
+def result_buffers(t, dtype=np.float64):
+    """Tampons colonnes pré-alloués pour la fenêtre t : un bloc (colonne × temps) de dtype, plus "time"."""
+    block = np.empty((len(RESULT_COLUMNS), len(t)), dtype=dtype)
+    buffers = {"time": np.asarray(t)}
+    buffers.update(zip(RESULT_COLUMNS, block))
+    return buffers
+
+def results_frame(buffers, index=None):
+    # copy=False : chaque colonne du DataFrame est une vue sur son tampon (aucune recopie)
+    return pd.DataFrame(buffers, index=index, copy=False)
+
+class Simulator:
+    def __init__(self, config, engine="numpy", seed=None, dtype=None):
+        self.c = config
+        self.n = len(config["buildings"])
+        # "numpy" (horizon complet en tableaux), "fleet" (bâtiments hétérogènes) ou "loop" (référence pas à pas)
+        # Le marché P2P a besoin du bilan de chaque bâtiment : trading à plusieurs → moteur fleet
+        self.trading = p2p_market(config)
+        self.engine = "fleet" if (config.get("fleet") or self.trading) and engine == "numpy" else engine
+        self.controller = compile_controller(config.get("control_code", ""))
+        self.fleet = None  # résultats par bâtiment (mode fleet)
+        self.market = None  # carnet compensé : volume / prix par heure, vendu / acheté par pair
+        self.aging = None  # vieillissement batterie : une ligne par bâtiment (fleet) ou pour le site
+        self.mpc = mpc_enabled(config)
+        self.optimal = optimal_enabled(config)
+        # Prévision pour le MPC : forecast(cons, pv) → conso − PV prévue à chaque heure (sans regarder l'heure
+        # elle-même, ex. forecaster.quantile_path), appelée une fois par série ; None → information parfaite
+        self.forecast = None
+        self.mpc_solves = 0
+        self.seed = config.get("seed") if seed is None else seed
+        self.weather_rng, self.load_rng = rng_streams(self.seed)
+        # Précision des tampons de résultats : float32 divise la mémoire par deux (KPI cumulés en float64)
+        self.dtype = np.dtype(dtype or config.get("precision", "float64"))
+
+    def weather(self):
+        return self.config_weather(self.c, self.seed, self.weather_rng)
+
+    @staticmethod
+    def config_weather(config, seed, rng):
+        # Site importé (EPW/TMY) → memmap du stock ; sinon météo saisonnière :
+        # graine fixée → tableaux mémoïsés partagés, sinon tirage sur le générateur météo fourni
+        if config.get("weather_site"):
+            store = open_store(config.get("weather_store", "weather_store"))
+            site = store.resolve(config["weather_site"], config["lat"], config["lon"])
+            return store.load(site, config.get("weather_year"))
+        if seed is None:
+            return fetch_seasonal_weather(config["lat"], config["lon"], current_season(), rng=rng)
+        return seasonal_weather(config["lat"], config["lon"], current_season(), seed)
+
+    def run(self):
+        weather = self.weather()
+        if self.engine == "loop":
+            results = self._run_loop(weather)
+        elif self.engine == "fleet":
+            results = self._run_fleet(weather)
+        else:
+            results = self._run_numpy(weather)
+        if self.mpc and self.engine != "fleet":
+            # Site agrégé : une seule batterie équivalente (capacité et puissance × bâtiments)
+            capacity = total_battery_capacity(self.c)
+            flow, soc = self._mpc(results["cons"], results["pv"], capacity, self.c["battery_power"] * self.n, self.c["initial_soc"] * capacity)
+            np.copyto(results["battery"], flow, casting="same_kind")
+            np.copyto(results["soc"], soc, casting="same_kind")
+        df = results_frame(results)
+        return df, self._kpis(df)
+
+    def _run_fleet(self, weather):
+        p = fleet_params(self.c)
+        fleet, out, self.market = self._simulate_fleet(weather, np.arange(self.c["timesteps"]), p["initial_soc"] * p["battery_capacity"])
+        self.fleet = {"building": list(self.c["buildings"]), **fleet}
+        return out
+
+    def _simulate_fleet(self, weather, t, soc0, dtype=np.float32):
+        # Parc hétérogène sur la fenêtre t : états (bâtiment × temps), traités par blocs de bâtiments pour borner la mémoire.
+        # soc0 : SOC de départ par bâtiment (simulation par tranches, cf. iter_run) ; le marché se compense heure par heure.
+        # Renvoie (colonnes par bâtiment, agrégat site, carnet compensé ou None)
+        steps = len(t)
+        block_size = max(1, (1 << 22) // max(steps, 1))  # ~4M cellules par bloc
+        temp_w, solar_w = np.asarray(weather["temp"]), np.asarray(weather["solar"])
+        temp_out = temp_w[t % len(temp_w)]
+        solar = solar_w[t % len(solar_w)]
+        p = fleet_params(self.c)
+        soc0 = np.asarray(soc0, dtype=float)
+        # Charge de base : un tirage par heure commun à tous les bâtiments, le même que le moteur numpy
+        # (nombres aléatoires communs : activer le marché ne change pas la charge simulée)
+        base = self.load_rng.uniform(7, 13, steps).astype(dtype, copy=False)
+
+        fleet = {k: np.empty((self.n, steps), dtype=dtype) for k in FLEET_COLUMNS}
+        for start in range(0, self.n, block_size):
+            b = slice(start, min(start + block_size, self.n))
+            target = p["temp_target"][b, None]
+            shape = (target.shape[0], steps)
+            states = {
+                "temp_target": np.broadcast_to(target, shape),
+                "current_temp": np.broadcast_to(target, shape),
+                "outdoor_temp": np.broadcast_to(temp_out, shape),
+                "solar": np.broadcast_to(solar, shape),
+            }
+            action = self.controller.batch(states, np.broadcast_to(t, shape))
+
+            hvac = np.abs(action) * 10
+            cons = hvac + base
+            pv = solar * p["pv_area"][b, None] * 0.0002
+            net = pv - cons
+            power = p["battery_power"][b, None]
+            bat = np.clip(net, -power, power)
+            delta = np.where(bat > 0, bat*0.95, bat/0.95)
+            capacity = p["battery_capacity"][b]
+
+            fleet["cons"][b], fleet["pv"][b], fleet["hvac"][b], fleet["battery"][b] = cons, pv, hvac, bat
+            fleet["temp"][b] = target + (temp_out - target)*0.05 + action*1.5
+            fleet["comfort"][b] = np.maximum(0, 1 - np.abs(action)/2)
+            if self.mpc:
+                # MPC bâtiment par bâtiment : chaque batterie optimise sa propre facture
+                for i in range(b.start, b.stop):
+                    fleet["battery"][i], fleet["soc"][i] = self._mpc(fleet["cons"][i], fleet["pv"][i], p["battery_capacity"][i], p["battery_power"][i], soc0[i])
+            else:
+                fleet["soc"][b] = soc_kernel_fleet(delta.astype(dtype), soc0[b], capacity.astype(dtype))
+
+        # Agrégat site : même contrat de colonnes que les autres moteurs
+        out = result_buffers(t, self.dtype)
+        for k in ("cons", "pv", "hvac", "soc", "battery"):
+            np.copyto(out[k], fleet[k].sum(axis=0, dtype=float))
+        for k in ("temp", "comfort"):
+            np.copyto(out[k], fleet[k].mean(axis=0, dtype=float))
+        market = None
+        if self.trading:
+            # Enchère double sur le résiduel de chaque bâtiment après batterie ; sans échange, prix de référence.
+            # Flux batterie réels (variation du SOC) : une batterie pleine ou vide ne lisse plus rien
+            stored = np.diff(fleet["soc"], axis=1, prepend=soc0[:, None].astype(dtype))
+            residual = fleet["pv"] - fleet["cons"] - np.where(stored > 0, stored/0.95, stored*0.95)
+            market = clear_market(residual, *peer_limits(self.c))
+            np.copyto(out["trade"], market["volume"], casting="same_kind")
+            np.copyto(out["price"], np.where(np.isnan(market["price"]), self.c["trading_price"], market["price"]), casting="same_kind")
+        else:
+            out["trade"].fill(0)
+            out["price"].fill(self.c["trading_price"] if self.c["enable_trading"] else 0)
+        return fleet, out, market
+
+    def _mpc(self, cons, pv, capacity, power, soc0):
+        forecast = None
+        if self.forecast is not None:
+            path = np.asarray(self.forecast(np.asarray(cons, dtype=float), np.asarray(pv, dtype=float)), dtype=float)
+            forecast = lambda t, h: path[t:t + h]
+        flow, soc, solves = mpc_dispatch(self.c, cons, pv, capacity, power, soc0, forecast)
+        self.mpc_solves += solves
+        return flow, soc
+
+    def market_settlements(self):
+        """Règlements P2P par bâtiment (None sans marché)."""
+        return None if self.market is None else settlements(self.market, self.c["buildings"])
+
+    def fleet_kpis(self):
+        """Tableau KPI par bâtiment (mode fleet), calculé sur les colonnes compactes."""
+        f = self.fleet
+        pv, cons = f["pv"].sum(axis=1, dtype=float), f["cons"].sum(axis=1, dtype=float)
+        table = pd.DataFrame({
+            "building": f["building"],
+            "total_pv_kwh": np.round(pv/1000, 2),
+            "total_consumption_kwh": np.round(cons/1000, 2),
+            "total_cost": np.round(cons*0.015 - pv*0.08, 2),
+            "avg_comfort": np.round(f["comfort"].mean(axis=1, dtype=float), 3),
+            "final_soc": f["soc"][:, -1],
+        })
+        if self.aging is not None:
+            table["capacity_fade_pct"] = np.round(self.aging["capacity_fade_pct"].to_numpy(), 3)
+            table["degradation_cost"] = np.round(self.aging["degradation_cost"].to_numpy(), 2)
+        if self.market is not None:
+            table["p2p_settlement"] = np.round(self.market_settlements()["net_settlement"].to_numpy(), 2)
+        return table
+
+    def _run_numpy(self, weather):
+        return self._fill(self._simulate_batch([self.c], weather, self.load_rng, dtype=self.dtype))
+
+    def _fill(self, cube):
+        # Scénario unique du cube → tampons compacts ; les temporaires float64 du calcul sont libérés ensuite
+        out = result_buffers(cube["time"][0], self.dtype)
+        for k in RESULT_COLUMNS:
+            np.copyto(out[k], cube[k][0], casting="same_kind")
+        return out
+
+    @classmethod
+    def run_batch(cls, configs, seed=None, common_random_numbers=True):
+        """Simule N scénarios en une passe : cube {colonne: (scénario × temps)} + table KPI (une ligne par scénario).
+
+        Les scénarios partagent la météo (site et horizon du premier) ; les parcs hétérogènes passent par run().
+        Avec common_random_numbers, tous partagent aussi le même tirage de charge de base : les écarts
+        entre candidats ne viennent que de leurs paramètres.
+        """
+        c0 = configs[0]
+        if any(c["timesteps"] != c0["timesteps"] for c in configs):
+            raise ValueError("run_batch : tous les scénarios doivent avoir le même nombre de pas de temps")
+        if any(c.get("fleet") for c in configs):
+            raise ValueError("run_batch : les parcs hétérogènes (fleet) ne sont pas empilables")
+        seed = c0.get("seed") if seed is None else seed
+        weather_rng, load_rng = rng_streams(seed)
+        weather = cls.config_weather(c0, seed, weather_rng)
+        cube = cls._simulate_batch(configs, weather, load_rng, common_random_numbers)
+        capacity = [total_battery_capacity(c) for c in configs]
+        soc0 = [c["initial_soc"] * cap for c, cap in zip(configs, capacity)]
+        for i, c in enumerate(configs):
+            if mpc_enabled(c):
+                cube["battery"][i], cube["soc"][i], _ = mpc_dispatch(c, cube["cons"][i], cube["pv"][i], capacity[i], c["battery_power"] * len(c["buildings"]), soc0[i])
+        aging = battery_aging(cube["soc"], capacity)
+        load = cube["cons"] - cube["pv"]
+        grid = np.array([series_grid_cost(c, load[i], cube["soc"][i], soc0[i]) for i, c in enumerate(configs)])
+        optimal = np.array([series_optimal_cost(c, load[i], capacity[i], c["battery_power"] * len(c["buildings"]), soc0[i])[0]
+                            if optimal_enabled(c) else np.nan for i, c in enumerate(configs)])
+        bill = np.array([series_bill(c, cube["cons"][i]) for i, c in enumerate(configs)])
+        return cube, cls.kpi_table(cube, aging, grid, optimal, bill)
+
+    @staticmethod
+    def _simulate_batch(configs, weather, rng, common_random_numbers=True, t=None, soc0=None, dtype=np.float64):
+        # Scénarios empilés sur l'axe 0 ; paramètres en colonnes (S, 1) diffusées sur le temps.
+        # t / soc0 : fenêtre temporelle et SOC de départ (simulation par tranches, cf. iter_run)
+        # dtype : précision de tous les intermédiaires (float32 → moitié moins de mémoire de pointe)
+        t = np.arange(configs[0]["timesteps"]) if t is None else t
+        steps = len(t)
+        temp_w, solar_w = np.asarray(weather["temp"], dtype=dtype), np.asarray(weather["solar"], dtype=dtype)
+        temp_out = temp_w[t % len(temp_w)]
+        solar = solar_w[t % len(solar_w)]
+        col = lambda key: np.array([float(c[key]) for c in configs], dtype=dtype)[:, None]
+        n = np.array([len(c["buildings"]) for c in configs], dtype=dtype)[:, None]
+        target = col("temp_target")
+        shape = (len(configs), steps)
+
+        # Un appel par contrôleur distinct, sur tous les scénarios qui le partagent
+        action = np.empty(shape, dtype=dtype)
+        groups = {}
+        for i, c in enumerate(configs):
+            groups.setdefault(code_hash(c.get("control_code", "")), []).append(i)
+        for rows in groups.values():
+            controller = compile_controller(configs[rows[0]].get("control_code", ""))
+            sub = (len(rows), steps)
+            states = {
+                "temp_target": np.broadcast_to(target[rows], sub),
+                "current_temp": np.broadcast_to(target[rows], sub),
+                "outdoor_temp": np.broadcast_to(temp_out, sub),
+                "solar": np.broadcast_to(solar, sub),
+            }
+            action[rows] = controller.batch(states, np.broadcast_to(t, sub))
+
+        hvac = np.abs(action) * 10
+        cons = hvac + rng.uniform(7, 13, steps if common_random_numbers else shape).astype(dtype, copy=False)
+        pv = solar * col("pv_area") * 0.0002 * n
+
+        net = pv - cons * n
+        power = col("battery_power") * n
+        bat = np.clip(net, -power, power)
+        delta = np.where(bat > 0, bat*0.95, bat/0.95)
+        capacity = col("battery_capacity")[:, 0] * n[:, 0]
+        soc0 = col("initial_soc")[:, 0] * capacity if soc0 is None else soc0
+        soc = soc_kernel_fleet(delta, soc0, capacity)
+
+        # Bâtiments identiques : aucun pair en face d'un autre, le marché P2P passe par le moteur fleet
+        trading = np.array([bool(c["enable_trading"]) for c in configs])[:, None]
+        trade = np.zeros(shape, dtype=dtype)
+        price = np.broadcast_to(np.where(trading, col("trading_price"), 0), shape)
+
+        return {
+            "time": np.broadcast_to(t, shape),
+            "cons": cons*n,
+            "pv": pv,
+            "hvac": hvac*n,
+            "temp": target + (temp_out - target)*0.05 + action*1.5,
+            "comfort": np.maximum(0, 1 - np.abs(action)/2),
+            "soc": np.ascontiguousarray(soc),
+            "battery": bat,
+            "trade": trade,
+            "price": price,
+        }
+
+    def _run_loop(self, weather):
+        steps = self.c["timesteps"]
+        results = result_buffers(np.arange(steps), self.dtype)
+        soc = self.c["initial_soc"] * self.c["battery_capacity"] * self.n
+
+        for t in range(steps):
+            temp_out = float(weather["temp"][t % len(weather["temp"])])
+            solar = float(weather["solar"][t % len(weather["solar"])])
+
+            # Contrôleur custom (compilé une fois) ou par défaut
+            action = self.controller.step({"temp_target": self.c["temp_target"], "current_temp": self.c["temp_target"], "outdoor_temp": temp_out, "solar": solar}, t)
+
+            hvac = abs(action) * 10
+            base = self.load_rng.uniform(7, 13)
+            cons = hvac + base
+            pv = solar * self.c["pv_area"] * 0.0002 * self.n
+
+            net = pv - cons * self.n
+            bat = np.clip(net, -self.c["battery_power"]*self.n, self.c["battery_power"]*self.n)
+            soc = np.clip(soc + (bat*0.95 if bat>0 else bat/0.95), 0, self.c["battery_capacity"]*self.n)
+
+            trade = price = 0  # bâtiments identiques : pas d'échange P2P (cf. moteur fleet)
+            if self.c["enable_trading"]:
+                price = self.c["trading_price"]
+
+            results["cons"][t] = cons*self.n
+            results["pv"][t] = pv
+            results["hvac"][t] = hvac*self.n
+            results["temp"][t] = self.c["temp_target"] + (temp_out - self.c["temp_target"])*0.05 + action*1.5
+            results["comfort"][t] = max(0, 1 - abs(action)/2)
+            results["soc"][t] = soc
+            results["battery"][t] = bat
+            results["trade"][t] = trade
+            results["price"][t] = price
+        return results
+
+    def iter_run(self, chunk_hours=24):
+        """Générateur : (bloc de résultats, KPI cumulés, fraction réalisée) toutes les chunk_hours heures.
+
+        La concaténation des blocs est identique à run() pour une même graine ; arrêter l'itération
+        annule le reste du calcul. Moteur fleet : SOC reporté bâtiment par bâtiment, marché compensé
+        tranche par tranche. Le moteur loop et le pilotage MPC (série complète) produisent un seul bloc.
+        """
+        if self.engine == "loop" or self.mpc:
+            df, kpis = self.run()
+            yield df, kpis, 1.0
+            return
+        weather = self.weather()
+        steps = self.c["timesteps"]
+        if self.engine == "fleet":
+            p = fleet_params(self.c)
+            capacity, power = p["battery_capacity"], p["battery_power"]
+            soc0 = p["initial_soc"] * capacity
+            self.fleet = {"building": list(self.c["buildings"])}
+            self.fleet.update((k, np.empty((self.n, steps), dtype=np.float32)) for k in FLEET_COLUMNS)
+            markets = []
+        else:
+            capacity = np.array([total_battery_capacity(self.c)])
+            power = np.array([self.c["battery_power"] * self.n])
+            soc0 = self.c["initial_soc"] * capacity
+        initial_soc = soc0
+        totals = dict.fromkeys(("pv", "cons", "trade", "comfort", "grid", "bill"), 0.0)
+        loads = []  # bilan complet (référence optimale demandée) : l'optimum hors ligne n'est calculable qu'au dernier bloc
+        meter = DegradationMeter(capacity)  # rainflow en flux : pas de seconde passe
+        for start in range(0, steps, chunk_hours):
+            t = np.arange(start, min(start + chunk_hours, steps))
+            if self.engine == "fleet":
+                block, out, market = self._simulate_fleet(weather, t, soc0)
+                for k in FLEET_COLUMNS:
+                    self.fleet[k][:, t] = block[k]
+                soc, load = block["soc"], block["cons"] - block["pv"].astype(float)
+                if market is not None:
+                    markets.append(market)
+                    load += market["sold"] - market["bought"]
+            else:
+                cube = self._simulate_batch([self.c], weather, self.load_rng, t=t, soc0=soc0, dtype=self.dtype)
+                out = self._fill(cube)
+                soc, load = cube["soc"], (cube["cons"] - cube["pv"]).astype(float)
+            buy, sell = tariff(self.c, t)
+            if self.optimal:
+                loads.append(load)
+            totals["grid"] += grid_cost(load, battery_flows(soc, soc0), buy, sell).sum()
+            totals["bill"] += (out["cons"] * buy).sum(dtype=float)
+            soc0 = soc[:, -1]
+            for k in ("pv", "cons", "trade", "comfort"):
+                totals[k] += out[k].sum(dtype=float)
+            self.aging = meter.update(soc).result()
+            done = t[-1] + 1
+            optimal = None
+            if done == steps:
+                if self.engine == "fleet" and markets:
+                    self.market = {k: np.concatenate([m[k] for m in markets], axis=-1) for k in markets[0]}
+                if self.optimal:
+                    optimal = series_optimal_cost(self.c, np.concatenate(loads, axis=1), capacity, power, initial_soc).sum(keepdims=True)
+            site = site_aging(self.aging, capacity) if self.engine == "fleet" else self.aging
+            kpis = self._kpis_from_totals(*(np.array([totals[k]]) for k in ("pv", "cons", "trade")), np.array([totals["comfort"] / done]), site, np.array([totals["grid"]]), optimal, np.array([totals["bill"]]))
+            yield results_frame(out, index=t), kpis.iloc[0].to_dict(), done / steps
+
+    @staticmethod
+    def kpi_table(cube, aging=None, grid=None, optimal=None, bill=None):
+        """KPI vectorisés : une ligne par scénario (axe 0 du cube) ; aging / grid / optimal : vieillissement,
+        coût réseau, coût réseau optimal (NaN : référence non calculée) et facture sans PV ni batterie du même cube."""
+        pv, cons, trade = (cube[k].sum(axis=1, dtype=float) for k in ("pv", "cons", "trade"))
+        return Simulator._kpis_from_totals(pv, cons, trade, cube["comfort"].mean(axis=1, dtype=float), aging, grid, optimal, bill)
+
+    @staticmethod
+    def _kpis_from_totals(pv, cons, trade, comfort, aging=None, grid=None, optimal=None, bill=None):
+        total_pv_kwh = np.round(pv/1000, 1)
+        table = pd.DataFrame({
+            "total_cost": np.round(cons*0.015 - pv*0.08 - trade*0.03, 2),  # Sans devise
+            "total_pv_kwh": total_pv_kwh,
+            "total_consumption_kwh": np.round(cons/1000, 1),
+            "avg_comfort": np.round(comfort, 3),
+            "co2_saved_kg": np.round(total_pv_kwh * (CO2_FACTOR / 1000), 1),  # Conversion g à kg
+            "trading_savings": np.round(trade*0.03/1000, 2),
+            "bill_reduction_pct": np.full(np.shape(cons), np.nan),  # cf. facture réseau ci-dessous
+        })
+        if aging is not None:
+            # Usure batterie : rapportée à part, non incluse dans total_cost
+            table["equivalent_full_cycles"] = np.round(aging["equivalent_full_cycles"].to_numpy(), 1)
+            table["capacity_fade_pct"] = np.round(aging["capacity_fade_pct"].to_numpy(), 3)
+            table["degradation_cost"] = np.round(aging["degradation_cost"].to_numpy(), 2)
+        if grid is not None:
+            # Facture réseau au tarif horaire (achats − reventes) : critère optimisé par le MPC
+            table["grid_cost"] = np.round(grid, 2)
+            if bill is not None:
+                # Part de la facture sans PV ni batterie évitée, au même tarif horaire, bornée à [0, 100]
+                saved = 1 - np.divide(grid, bill, out=np.ones(np.shape(grid)), where=np.asarray(bill) > 0)
+                table["bill_reduction_pct"] = np.round(np.clip(saved * 100, 0, 100), 1)
+            # Écart au pilotage optimal (programmation dynamique) ; légèrement négatif possible : grille de SOC discrète.
+            # Colonnes toujours présentes, NaN si la référence n'est pas demandée (schéma KPI stable)
+            optimal = np.full(np.shape(grid), np.nan) if optimal is None else np.asarray(optimal, dtype=float)
+            gap = grid - optimal
+            table["optimal_grid_cost"] = np.round(optimal, 2)
+            table["gap_to_optimal"] = np.round(gap, 2)
+            table["gap_to_optimal_pct"] = np.round(np.divide(gap * 100, np.abs(optimal), out=np.where(np.isnan(gap), np.nan, 0.0), where=np.abs(optimal) > 1e-9), 1)
+        return table
+
+    def _kpis(self, df):
+        # Vieillissement par bâtiment en mode fleet (SOC individuels), sinon sur le SOC agrégé du site
+        # Coût réseau par compteur : chaque bâtiment (échanges P2P déduits) en mode fleet, sinon le site
+        if self.fleet is not None:
+            p = fleet_params(self.c)
+            capacity = p["battery_capacity"]
+            self.aging = battery_aging(self.fleet["soc"], capacity)
+            site = site_aging(self.aging, capacity)
+            load = self.fleet["cons"] - self.fleet["pv"].astype(float)
+            if self.market is not None:
+                load += self.market["sold"] - self.market["bought"]
+            grid = series_grid_cost(self.c, load, self.fleet["soc"], p["initial_soc"] * capacity).sum(keepdims=True)
+            optimal = None
+            if self.optimal:
+                optimal = series_optimal_cost(self.c, load, capacity, p["battery_power"], p["initial_soc"] * capacity).sum(keepdims=True)
+        else:
+            capacity = total_battery_capacity(self.c)
+            self.aging = site = battery_aging(df["soc"].to_numpy(), [capacity])
+            load = (df["cons"] - df["pv"]).to_numpy()[None]
+            grid = series_grid_cost(self.c, load, df["soc"].to_numpy()[None], [self.c["initial_soc"] * capacity])
+            optimal = series_optimal_cost(self.c, load, capacity, self.c["battery_power"] * self.n, self.c["initial_soc"] * capacity) if self.optimal else None
+        cube = {k: df[k].to_numpy()[None] for k in ("pv", "cons", "trade", "comfort")}
+        return self.kpi_table(cube, site, grid, optimal, series_bill(self.c, cube["cons"])).iloc[0].to_dict()
+
+# =====================================
+# OPTIMISATION (exécutée dans les workers du pool)
+# =====================================
+def kp_control_code(kp):
+    return f"def control(state, t):\n    error = state['temp_target'] - state['outdoor_temp']\n    return np.clip(error * {kp:.2f}, -1, 1)"
+
+def evaluate_kp(config, kp_values, seed):
+    """Coûts d'une tranche de valeurs de Kp : un run_batch par tranche (une boucle en mode fleet).
+
+    Toutes les tranches reçoivent la même graine : nombres aléatoires communs à tous les candidats.
+    Bâtiments identiques : même charge de base, bilans égaux, le marché P2P n'échange rien → run_batch suffit.
+    Seul total_cost compte : pas de référence optimale par candidat.
+    """
+    configs = [dict(config, control_code=kp_control_code(kp), optimal_baseline=False) for kp in kp_values]
+    if config.get("fleet"):
+        return [Simulator(c, seed=seed).run()[1]["total_cost"] for c in configs]
+    return Simulator.run_batch(configs, seed=seed)[1]["total_cost"].tolist()
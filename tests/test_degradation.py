@@ -0,0 +1,32 @@
+# =============================================
+# IKSOU Pro – Tests : comptage rainflow du vieillissement batterie
+# =============================================
+
+import numpy as np
+import pytest
+
+from degradation import CYCLE_LIFE, DOD_EXPONENT, END_OF_LIFE_FADE, SOC_STRESS, DegradationMeter, battery_aging
+
+# Exemple de la norme ASTM E1049-85 (§ 5.4.4), décalé de +5 pour rester dans [0, 10] kWh
+ASTM_SERIES = np.array([-2, 1, -3, 5, -1, 3, -4, 4, -2]) + 5.0
+# Comptage attendu : étendue 3 → 0,5 ; 4 → 1,5 ; 6 → 0,5 ; 8 → 1,0 ; 9 → 0,5 (4 cycles au total).
+# (étendue, niveau moyen, nombre de cycles), en kWh
+ASTM_CYCLES = [(3, 4.5, 0.5), (4, 4.0, 0.5), (4, 6.0, 1.0), (8, 6.0, 0.5), (9, 5.5, 0.5), (8, 5.0, 0.5), (6, 6.0, 0.5)]
+
+
+def test_astm_rainflow_counts():
+    aging = battery_aging(ASTM_SERIES[None], [10.0])
+    depth, mean, count = (np.array(column, dtype=float) for column in zip(*ASTM_CYCLES))
+    assert count.sum() == 4.0
+    assert aging["equivalent_full_cycles"][0] == pytest.approx((count * depth).sum() / 10)
+    damage = (count * (depth / 10) ** DOD_EXPONENT / CYCLE_LIFE * np.exp(SOC_STRESS * (mean / 10 - 0.5))).sum()
+    assert aging["cycle_fade_pct"][0] == pytest.approx(END_OF_LIFE_FADE * damage * 100)
+
+
+def test_streamed_chunks_match_single_pass():
+    rng = np.random.default_rng(0)
+    soc = np.clip(5 + 4 * np.sin(np.arange(500) / 4)[None] + rng.normal(0, 0.5, (3, 500)), 0, 10)
+    meter = DegradationMeter(np.full(3, 10.0))
+    for chunk in np.array_split(soc, 7, axis=1):
+        meter.update(chunk)
+    np.testing.assert_allclose(meter.result().to_numpy(), battery_aging(soc, np.full(3, 10.0)).to_numpy())
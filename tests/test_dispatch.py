@@ -0,0 +1,38 @@
+# =============================================
+# IKSOU Pro – Tests : référence optimale du pilotage batterie
+# =============================================
+
+import numpy as np
+import pytest
+from scipy.optimize import linprog
+
+from dispatch import EFFICIENCY, optimal_dispatch
+
+
+def lp_optimum(load, buy, sell, capacity, power, soc0):
+    """Même problème en programme linéaire continu sur tout l'horizon.
+
+    Variables par heure : charge, décharge (côté bâtiment, ≤ power), achat, revente ; SOC borné à [0, capacity].
+    """
+    n = len(load)
+    eye, zero = np.eye(n), np.zeros((n, n))
+    cost = np.concatenate([np.zeros(2 * n), buy, -sell])
+    balance = np.hstack([eye, -eye, -eye, eye])  # load + charge − décharge = achat − revente
+    stored = np.tril(np.ones((n, n)))
+    soc = np.hstack([stored * EFFICIENCY, -stored / EFFICIENCY, zero, zero])  # SOC_t − soc0
+    bounds = [(0, power)] * (2 * n) + [(0, None)] * (2 * n)
+    res = linprog(cost, A_ub=np.vstack([soc, -soc]), b_ub=np.concatenate([np.full(n, capacity - soc0), np.full(n, soc0)]),
+                  A_eq=balance, b_eq=-np.asarray(load), bounds=bounds, method="highs")
+    assert res.success
+    return res.fun
+
+
+def test_dp_matches_full_horizon_lp():
+    load = np.array([2.0, -3.0, -4.0, -1.0, 1.0, 3.0, 5.0, 2.0, -1.0, 4.0])
+    buy = np.array([0.20, 0.20, 0.20, 0.20, 0.20, 0.30, 0.30, 0.30, 0.20, 0.20])
+    sell = np.full(len(load), 0.06)
+    capacity, power, soc0 = 10.0, 3.0, 2.0
+    dp = optimal_dispatch(load, buy, sell, capacity, power, soc0, levels=2001)
+    # Grille de SOC de 5 Wh : l'écart au LP continu reste sous le centime
+    assert dp["cost"] == pytest.approx(lp_optimum(load, buy, sell, capacity, power, soc0), abs=0.01)
+    assert np.all((dp["soc"] >= 0) & (dp["soc"] <= capacity))
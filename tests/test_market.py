@@ -0,0 +1,28 @@
+# =============================================
+# IKSOU Pro – Tests : enchère double du marché P2P
+# =============================================
+
+import numpy as np
+import pytest
+
+from market import clear_market
+
+
+def test_hand_example_clears_8_kwh_at_0_11():
+    # Vendeurs A, B, C : 5 kWh chacun à 0.08 / 0.10 / 0.14 ; acheteurs D, E, F : 6 / 2 / 4 kWh à 0.13 / 0.12 / 0.09.
+    # F (0.09) est sous le prix de B, C (0.14) au-dessus de toute enchère restante : 8 kWh échangés,
+    # prix = milieu entre la dernière vente (B, 0.10) et le dernier achat (E, 0.12) retenus
+    net = np.array([[5.0], [5.0], [5.0], [-6.0], [-2.0], [-4.0]])
+    ask = np.array([0.08, 0.10, 0.14, 0.0, 0.0, 0.0])
+    bid = np.array([0.0, 0.0, 0.0, 0.13, 0.12, 0.09])
+    market = clear_market(net, ask, bid)
+    assert market["volume"][0] == pytest.approx(8.0)
+    assert market["price"][0] == pytest.approx(0.11)
+    np.testing.assert_allclose(market["sold"][:, 0], [5, 3, 0, 0, 0, 0])
+    np.testing.assert_allclose(market["bought"][:, 0], [0, 0, 0, 6, 2, 0])
+
+
+def test_no_trade_gives_nan_price():
+    market = clear_market(np.array([[2.0], [-2.0]]), np.array([0.15, 0.0]), np.array([0.0, 0.10]))
+    assert market["volume"][0] == 0
+    assert np.isnan(market["price"][0])
@@ -0,0 +1,286 @@
+# =============================================
+# IKSOU Pro – Stock météo horaire (EPW / TMY)
+# Import texte une seule fois → tableaux binaires float32 ouverts en memmap
+# Un fichier .npy par (site, année) + un catalogue JSON
+# Index spatial (BallTree haversine) pour associer un site à la station la plus proche
+# Positions : LOCATION de l'EPW, sinon catalogue de stations (stations.csv), sinon position fournie
+# =============================================
+
+import hashlib
+import io
+import json
+import os
+import pickle
+import re
+import threading
+from functools import lru_cache
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+WEATHER_VARIABLES = ("temp", "solar")
+EARTH_RADIUS_KM = 6371.0
+NEAREST_STATION = "nearest"  # valeur de config["weather_site"] : station la plus proche de (lat, lon)
+STATIONS_CSV = "stations.csv"  # catalogue de stations externe, dans le répertoire du stock (optionnel)
+
+# Noms de colonnes reconnus dans les CSV horaires (TMY3, PVGIS, exports maison)
+_COLUMN_ALIASES = {
+    "temp": ("temp", "temperature", "t2m", "dry-bulb (c)", "dry bulb temperature", "drybulb", "temp_air", "température (°c)"),
+    "solar": ("solar", "ghi", "g(h)", "ghi (w/m^2)", "global horizontal radiation", "irradiation (w/m²)"),
+}
+
+# Colonnes EPW (0-indexées) : température sèche et rayonnement global horizontal
+_EPW_TEMP, _EPW_GHI = 6, 13
+
+
+def _site_key(site, year):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{site}_{year}")
+
+
+def _find_column(columns, variable):
+    names = {str(c).strip().lower(): c for c in columns}
+    for alias in _COLUMN_ALIASES[variable]:
+        if alias in names:
+            return names[alias]
+    raise ValueError(f"Colonne '{variable}' introuvable (attendu : {', '.join(_COLUMN_ALIASES[variable])})")
+
+
+def parse_epw(text):
+    """EPW → (tableau (2, heures), métadonnées du LOCATION)."""
+    lines = text.splitlines()
+    location = lines[0].split(",")
+    if location[0].strip().upper() != "LOCATION":
+        raise ValueError("Fichier EPW invalide : première ligne LOCATION attendue")
+    rows = pd.read_csv(io.StringIO("\n".join(lines[8:])), header=None, usecols=[0, _EPW_TEMP, _EPW_GHI])
+    meta = {
+        "name": location[1].strip(),
+        "lat": float(location[6]),
+        "lon": float(location[7]),
+        "year": int(rows[0].mode().iloc[0]),
+    }
+    data = np.vstack([rows[_EPW_TEMP].to_numpy(), rows[_EPW_GHI].to_numpy()])
+    return data, meta
+
+
+def parse_csv(text):
+    """CSV horaire : l'en-tête est la première ligne contenant une colonne de température reconnue."""
+    lines = text.splitlines()
+    for skip, line in enumerate(lines[:50]):
+        cells = [c.strip().lower() for c in line.split(",")]
+        if any(alias in cells for alias in _COLUMN_ALIASES["temp"]):
+            break
+    else:
+        raise ValueError("En-tête CSV introuvable (colonnes température / rayonnement)")
+    df = pd.read_csv(io.StringIO("\n".join(lines[skip:])))
+    data = np.vstack([pd.to_numeric(df[_find_column(df.columns, v)], errors="coerce").to_numpy() for v in WEATHER_VARIABLES])
+    data = data[:, ~np.isnan(data).any(axis=0)]  # lignes de pied de fichier (PVGIS) ou vides
+    return data, {}
+
+
+class StationIndex:
+    """Index BallTree (distance haversine) sur les coordonnées des stations : k plus proches, en lot."""
+
+    def __init__(self, stations, fingerprint=None):
+        self.stations = stations.reset_index(drop=True)
+        self.fingerprint = fingerprint
+        self.tree = BallTree(np.radians(self.stations[["lat", "lon"]].to_numpy(dtype=float)), metric="haversine")
+
+    @classmethod
+    def from_csv(cls, path):
+        """Catalogue de stations externe : colonnes key (ou station_id), lat, lon."""
+        stations = pd.read_csv(path).rename(columns={"station_id": "key"})
+        stations["key"] = stations["key"].astype(str)
+        return cls(stations.dropna(subset=["lat", "lon"]))
+
+    def position(self, key):
+        """(lat, lon) de la station key, None si absente du catalogue."""
+        row = self.stations[self.stations["key"] == str(key)]
+        return None if row.empty else (float(row["lat"].iloc[0]), float(row["lon"].iloc[0]))
+
+    def query(self, lat, lon, k=1):
+        """(distances en km, clés) de forme (sites × k) pour des listes de coordonnées."""
+        points = np.radians(np.column_stack([np.atleast_1d(lat), np.atleast_1d(lon)]).astype(float))
+        dist, idx = self.tree.query(points, k=min(k, len(self.stations)))
+        return dist * EARTH_RADIUS_KM, self.stations["key"].to_numpy()[idx]
+
+    def save(self, path):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+
+
+@lru_cache(maxsize=256)
+def _open(path, mtime):
+    # mtime dans la clé : un ré-import du même site invalide la projection
+    return np.load(path, mmap_mode="r")
+
+
+class WeatherStore:
+    """Stock de séries météo horaires : import unique, lecture en memmap sans parsing ni copie en RAM."""
+
+    def __init__(self, directory="weather_store"):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._catalog_path = os.path.join(directory, "catalog.json")
+        self._catalog_mtime = None
+        self._catalog = {}
+        self._index = self._index_mtime = None
+        self._stations = self._stations_mtime = None
+        self._refresh()
+
+    def _refresh(self):
+        # Relit le catalogue s'il a été modifié (import fait par un autre processus)
+        try:
+            mtime = os.stat(self._catalog_path).st_mtime_ns
+            if mtime == self._catalog_mtime:
+                return
+            with open(self._catalog_path, encoding="utf-8") as f:
+                self._catalog = json.load(f)
+            self._catalog_mtime = mtime
+        except (OSError, ValueError):
+            pass
+
+    def _write_catalog(self):
+        tmp = f"{self._catalog_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._catalog, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self._catalog_path)
+
+    def import_file(self, source, site=None, year=None, lat=None, lon=None, name=None):
+        """Importe un EPW ou un CSV horaire (chemin ou fichier ouvert) ; renvoie l'identifiant du site.
+
+        Position : LOCATION de l'EPW, sinon le catalogue de stations (site ou nom), sinon lat / lon fournis.
+        """
+        if hasattr(source, "read"):
+            raw, filename = source.read(), getattr(source, "name", "")
+        else:
+            with open(source, "rb") as f:
+                raw, filename = f.read(), source
+        text = raw.decode("utf-8-sig", errors="replace") if isinstance(raw, bytes) else raw
+        if filename.lower().endswith(".epw") or text.lstrip().upper().startswith("LOCATION"):
+            data, meta = parse_epw(text)
+        else:
+            data, meta = parse_csv(text)
+        site = site or meta.get("name") or os.path.splitext(os.path.basename(filename))[0] or "site"
+        if "lat" not in meta:
+            catalogue = self.station_catalogue()
+            position = catalogue and (catalogue.position(site) or catalogue.position(name))
+            if position:
+                meta.update(lat=position[0], lon=position[1])
+        return self.add(site, data, year=year or meta.get("year", "tmy"),
+                        lat=meta.get("lat", lat), lon=meta.get("lon", lon),
+                        name=name or meta.get("name") or site)
+
+    def station_catalogue(self):
+        """Catalogue externe STATIONS_CSV du stock (StationIndex.from_csv), relu s'il change ; None s'il est absent."""
+        path = os.path.join(self.directory, STATIONS_CSV)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self._stations_mtime:
+            self._stations, self._stations_mtime = StationIndex.from_csv(path), mtime
+        return self._stations
+
+    def add(self, site, data, year="tmy", lat=None, lon=None, name=None):
+        """Enregistre un tableau (2, heures) [temp, solar] sous (site, année)."""
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        if data.ndim != 2 or data.shape[0] != len(WEATHER_VARIABLES) or data.shape[1] == 0:
+            raise ValueError("Données météo attendues : tableau (temp, solar) × heures")
+        key = _site_key(site, year)
+        path = os.path.join(self.directory, f"{key}.npy")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._refresh()
+            self._catalog[key] = {
+                "site": str(site), "year": str(year), "name": name or str(site),
+                "lat": lat, "lon": lon, "hours": int(data.shape[1]),
+                "digest": hashlib.sha256(data.tobytes()).hexdigest(),
+            }
+            self._write_catalog()
+            self._catalog_mtime = os.stat(self._catalog_path).st_mtime_ns
+        return key
+
+    def sites(self):
+        """Catalogue : une ligne par (site, année)."""
+        self._refresh()
+        return pd.DataFrame.from_dict(self._catalog, orient="index").rename_axis("key").reset_index()
+
+    def station_index(self):
+        """Index spatial des sites géolocalisés : reconstruit seulement si le catalogue change, persisté sur disque."""
+        self._refresh()
+        if self._index is not None and self._index_mtime == self._catalog_mtime:
+            return self._index
+        stations = self.sites()
+        if stations.empty or not {"lat", "lon"} <= set(stations.columns):
+            raise ValueError("Aucune station géolocalisée dans le stock météo")
+        stations = stations.dropna(subset=["lat", "lon"])[["key", "name", "lat", "lon"]]
+        if stations.empty:
+            raise ValueError("Aucune station géolocalisée dans le stock météo")
+        fingerprint = hashlib.sha256(stations.to_json(orient="values").encode("utf-8")).hexdigest()
+        if self._index is not None and self._index.fingerprint == fingerprint:
+            return self._index
+        path = os.path.join(self.directory, "stations.idx")
+        index = StationIndex.load(path)
+        if index is None or index.fingerprint != fingerprint:
+            index = StationIndex(stations, fingerprint)
+            index.save(path)
+        self._index, self._index_mtime = index, self._catalog_mtime
+        return index
+
+    def nearest(self, lat, lon, k=1):
+        """Stations les plus proches pour une liste de sites : DataFrame (site, rang, key, distance_km)."""
+        dist, keys = self.station_index().query(lat, lon, k)
+        return pd.DataFrame({
+            "site": np.repeat(np.arange(keys.shape[0]), keys.shape[1]),
+            "rank": np.tile(np.arange(keys.shape[1]), keys.shape[0]),
+            "key": keys.ravel(),
+            "distance_km": dist.ravel(),
+        })
+
+    def resolve(self, site, lat=None, lon=None):
+        """Clé effective : NEAREST_STATION → station la plus proche de (lat, lon)."""
+        if site == NEAREST_STATION:
+            return self.station_index().query(lat, lon, 1)[1][0, 0]
+        return site
+
+    def _entry(self, site, year=None):
+        self._refresh()
+        key = site if site in self._catalog else None
+        if key is None:
+            matches = sorted(k for k, e in self._catalog.items() if e["site"] == site and (year is None or e["year"] == str(year)))
+            if not matches:
+                raise ValueError(f"Site météo inconnu : {site}" + (f" ({year})" if year is not None else ""))
+            key = matches[-1]
+        return key, self._catalog[key]
+
+    def digest(self, site, year=None):
+        return self._entry(site, year)[1]["digest"]
+
+    def load(self, site, year=None):
+        """{"temp", "solar"} en vues memmap lecture seule : même contrat que seasonal_weather."""
+        key, _ = self._entry(site, year)
+        path = os.path.join(self.directory, f"{key}.npy")
+        data = _open(path, os.stat(path).st_mtime_ns)
+        return MappingProxyType(dict(zip(WEATHER_VARIABLES, data)))
+
+
+@lru_cache(maxsize=8)
+def open_store(directory="weather_store"):
+    """Stock partagé par processus (simulateur, pages, workers)."""
+    return WeatherStore(directory)